@@ -6,6 +6,7 @@ from django.utils.http import url_has_allowed_host_and_scheme
 from django.http import HttpResponseRedirect
 from environs import Env
 
+from .models import Banner
 from .models import Product
 from .models import ProductCategory
 from .models import Restaurant
@@ -33,6 +34,7 @@ class RestaurantAdmin(admin.ModelAdmin):
         'name',
         'address',
         'contact_phone',
+        'dispatch_capacity',
     ]
     inlines = [
         RestaurantMenuItemInline
@@ -105,7 +107,13 @@ class ProductAdmin(admin.ModelAdmin):
         if not obj.image or not obj.id:
             return 'нет картинки'
         edit_url = reverse('admin:foodcartapp_product_change', args=(obj.id,))
-        return format_html('<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>', edit_url=edit_url, src=obj.image.url)
+        src = obj.image.url
+        if obj.image_derivatives.get('source') == obj.image.name:
+            smallest = min(obj.image_derivatives['srcset'], default=None,
+                           key=lambda derivative: derivative['width'])
+            if smallest:
+                src = obj.image.storage.url(smallest['name'])
+        return format_html('<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>', edit_url=edit_url, src=src)
     get_image_list_preview.short_description = 'превью'
 
 
@@ -114,6 +122,29 @@ class ProductAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(Banner)
+class BannerAdmin(admin.ModelAdmin):
+    list_display = [
+        'get_image_list_preview',
+        'title',
+        'order',
+        'active_from',
+        'active_until',
+    ]
+    list_display_links = [
+        'title',
+    ]
+    list_editable = [
+        'order',
+    ]
+
+    def get_image_list_preview(self, obj):
+        if not obj.image:
+            return 'нет картинки'
+        return format_html('<img src="{src}" style="max-height: 50px;"/>', src=obj.image.url)
+    get_image_list_preview.short_description = 'превью'
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
@@ -126,9 +157,17 @@ class OrderAdmin(admin.ModelAdmin):
     ]
     list_display = [
         '__str__',
-        'created_at'
+        'created_at',
+        'total_price',
+    ]
+    readonly_fields = [
+        'total_price',
     ]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Order.objects.filter(pk=form.instance.pk).update_total_prices()
+
     def response_change(self, request, obj):
         response = super().response_change(request, obj)
         next_url = request.GET.get('next')
@@ -0,0 +1,243 @@
+import contextlib
+import threading
+
+import numpy as np
+
+from .caching import VersionedCache
+from .models import Restaurant, RestaurantMenuItem
+
+
+availability_cache = VersionedCache('availability')
+
+def encode_bits(positions, size):
+    """Bitset of `size` bits with the bits at the positions set."""
+    digits = bytearray(b'0' * size)
+    for position in positions:
+        digits[size - 1 - position] = ord('1')
+    return int(digits or b'0', 2)
+
+
+def decode_bits(bits, values):
+    """List of those of the values, a numpy array, whose positions are set
+    in the bitset."""
+    # Bits are unpacked a byte at a time by numpy, not one by one
+    flags = np.unpackbits(
+        np.frombuffer(bits.to_bytes((len(values) + 7) // 8, 'little'),
+                      dtype=np.uint8),
+        count=len(values),
+        bitorder='little',
+    )
+    return values[flags.view(bool)].tolist()
+
+
+class AvailabilityIndex:
+    """In-memory index of which restaurant sells which products.
+
+    It keeps two views of the same data as bitsets: the available products
+    of every restaurant, where bit N stands for the product at position N
+    of `_product_ids`, and the restaurants of every product, where bit N
+    stands for the restaurant at position N of `_restaurant_ids`.
+    Restaurants that can cook a whole order are then found with a bitwise
+    AND of a few integers, and changing a product only touches the bitsets
+    of the restaurants that sell it.
+
+    The process that changes availability updates its index in place and
+    bumps the shared availability version. Other processes notice the new
+    version and rebuild their index on the next lookup. Inside `pinned()`
+    the version is checked once for all the lookups of the block.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pinned = threading.local()
+        self._version = None
+        self._restaurant_ids = []
+        self._restaurant_positions = {}
+        self._product_ids = []
+        self._product_positions = {}
+        self._restaurant_id_array = np.array([], dtype=np.int64)
+        self._product_id_array = np.array([], dtype=np.int64)
+        self._products_by_restaurant = {}
+        self._restaurants_by_product = {}
+
+    def load(self, restaurant_ids, menu_items, version=None):
+        """Fill the index from restaurant ids and available (restaurant id,
+        product id) pairs, built at the given availability version."""
+        restaurant_ids = sorted(restaurant_ids)
+        menu_items = list(menu_items)
+        product_ids = sorted({product_id for _, product_id in menu_items})
+        restaurant_positions = {
+            restaurant_id: position
+            for position, restaurant_id in enumerate(restaurant_ids)
+        }
+        product_positions = {
+            product_id: position
+            for position, product_id in enumerate(product_ids)
+        }
+        positions_by_restaurant = {
+            restaurant_id: [] for restaurant_id in restaurant_ids}
+        positions_by_product = {product_id: [] for product_id in product_ids}
+        for restaurant_id, product_id in menu_items:
+            positions_by_restaurant[restaurant_id].append(
+                product_positions[product_id])
+            positions_by_product[product_id].append(
+                restaurant_positions[restaurant_id])
+
+        self._restaurant_ids = restaurant_ids
+        self._restaurant_positions = restaurant_positions
+        self._product_ids = product_ids
+        self._product_positions = product_positions
+        self._restaurant_id_array = np.array(restaurant_ids, dtype=np.int64)
+        self._product_id_array = np.array(product_ids, dtype=np.int64)
+        self._products_by_restaurant = {
+            restaurant_id: encode_bits(positions, len(product_ids))
+            for restaurant_id, positions in positions_by_restaurant.items()
+        }
+        self._restaurants_by_product = {
+            product_id: encode_bits(positions, len(restaurant_ids))
+            for product_id, positions in positions_by_product.items()
+        }
+        self._version = version
+
+    def _build(self, version):
+        self.load(
+            Restaurant.objects.values_list('id', flat=True),
+            RestaurantMenuItem.objects
+            .filter(availability=True)
+            .values_list('restaurant_id', 'product_id'),
+            version=version,
+        )
+
+    def _ensure_fresh(self):
+        if getattr(self._pinned, 'depth', 0):
+            return
+        version = availability_cache.get_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._build(version)
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """Check the availability version once and serve the lookups of
+        the current thread inside the block from memory only."""
+        self._ensure_fresh()
+        self._pinned.depth = getattr(self._pinned, 'depth', 0) + 1
+        try:
+            yield self
+        finally:
+            self._pinned.depth -= 1
+
+    def update_products(self, product_ids, menu_items):
+        """Replace availability of the products with the given available
+        (restaurant id, product id) pairs."""
+        product_ids = set(product_ids)
+        restaurants_by_product = dict(self._restaurants_by_product)
+        # Restaurants that sold the products lose them, the others keep
+        # their bitsets untouched
+        new_bits = {
+            restaurant_id: 0
+            for product_id in product_ids
+            for restaurant_id in decode_bits(
+                restaurants_by_product.pop(product_id, 0),
+                self._restaurant_id_array)
+        }
+        for restaurant_id, product_id in menu_items:
+            position = self._restaurant_positions.get(restaurant_id)
+            if position is None:
+                # A restaurant created after the index was built
+                position = len(self._restaurant_ids)
+                self._restaurant_ids.append(restaurant_id)
+                self._restaurant_positions[restaurant_id] = position
+            restaurants_by_product[product_id] = \
+                restaurants_by_product.get(product_id, 0) | 1 << position
+
+            product_position = self._product_positions.get(product_id)
+            if product_position is None:
+                product_position = len(self._product_ids)
+                self._product_ids.append(product_id)
+                self._product_positions[product_id] = product_position
+            new_bits[restaurant_id] = \
+                new_bits.get(restaurant_id, 0) | 1 << product_position
+
+        mask = 0
+        for product_id in product_ids:
+            if product_id in self._product_positions:
+                mask |= 1 << self._product_positions[product_id]
+        # Lookups read the bitsets first, so the id arrays must already
+        # have the positions the new bitsets use
+        self._restaurant_id_array = np.array(self._restaurant_ids,
+                                             dtype=np.int64)
+        self._product_id_array = np.array(self._product_ids, dtype=np.int64)
+        products_by_restaurant = dict(self._products_by_restaurant)
+        for restaurant_id, bits in new_bits.items():
+            products_by_restaurant[restaurant_id] = \
+                products_by_restaurant.get(restaurant_id, 0) & ~mask | bits
+
+        self._products_by_restaurant = products_by_restaurant
+        self._restaurants_by_product = restaurants_by_product
+
+    def refresh_products(self, product_ids):
+        menu_items = list(
+            RestaurantMenuItem.objects
+            .filter(product_id__in=product_ids, availability=True)
+            .values_list('restaurant_id', 'product_id')
+        )
+        with self._lock:
+            self.update_products(product_ids, menu_items)
+
+            was_fresh = self._version == availability_cache.get_version()
+            availability_cache.bump()
+            if was_fresh:
+                self._version = availability_cache.get_version()
+
+    def invalidate(self):
+        availability_cache.bump_on_commit()
+
+    def restaurant_ids(self):
+        self._ensure_fresh()
+        return sorted(self._products_by_restaurant)
+
+    def products_for_restaurant(self, restaurant_id):
+        self._ensure_fresh()
+        products = self._products_by_restaurant.get(restaurant_id)
+        if products is None:
+            return None
+        return sorted(decode_bits(products, self._product_id_array))
+
+    def iter_availability_rows(self, product_ids, restaurant_ids):
+        """Yield a row of availability flags for every product, with one
+        flag per restaurant in the order of `restaurant_ids`."""
+        self._ensure_fresh()
+        positions = [
+            self._restaurant_positions.get(restaurant_id)
+            for restaurant_id in restaurant_ids
+        ]
+        for product_id in product_ids:
+            # Bit N of the bitset is character N of the reversed binary
+            bits = bin(self._restaurants_by_product.get(product_id, 0))[:1:-1]
+            yield [
+                position is not None and position < len(bits)
+                and bits[position] == '1'
+                for position in positions
+            ]
+
+    def restaurants_for(self, product_ids):
+        """Ids of the restaurants that have all the products for sale."""
+        self._ensure_fresh()
+        product_ids = list(product_ids)
+        if not product_ids:
+            return set()
+
+        restaurants_by_product = self._restaurants_by_product
+        restaurants = restaurants_by_product.get(product_ids[0], 0)
+        for product_id in product_ids[1:]:
+            if not restaurants:
+                break
+            restaurants &= restaurants_by_product.get(product_id, 0)
+
+        return set(decode_bits(restaurants, self._restaurant_id_array))
+
+
+availability_index = AvailabilityIndex()
@@ -0,0 +1,83 @@
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+class VersionedCache:
+    """Cache of values that all become stale at once.
+
+    Every cached value is stored under the current version number, and
+    bumping the version invalidates all of them. The last built values are
+    also kept in process memory, so a request for a fresh value costs one
+    lookup of the version in the shared cache.
+    """
+
+    def __init__(self, name, timeout=24 * 60 * 60):
+        self.name = name
+        self.timeout = timeout
+        self.version_key = f'{name}:version'
+        self.hits = 0
+        self.misses = 0
+        self._local_values = {}
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, time.time_ns(), timeout=None)
+            version = cache.get(self.version_key)
+        return version
+
+    def bump(self):
+        version = cache.get(self.version_key, 0)
+        cache.set(self.version_key,
+                  max(time.time_ns(), version + 1),
+                  timeout=None)
+
+    def bump_on_commit(self):
+        transaction.on_commit(self.bump)
+
+    def get_local(self, key, version):
+        """The value kept in process memory for the version, if any."""
+        local_version, value = self._local_values.get(key, (None, None))
+        return value if local_version == version else None
+
+    def get(self, key, version):
+        """The value stored in the shared cache for the version, if any;
+        it is never built."""
+        return cache.get(f'{self.name}:{version}:{key}')
+
+    def set(self, key, value, version):
+        cache.set(f'{self.name}:{version}:{key}', value, timeout=self.timeout)
+
+    def get_or_build(self, key, build, version=None, keep_local=True):
+        if version is None:
+            version = self.get_version()
+        local_version, value = self._local_values.get(key, (None, None))
+        if local_version == version:
+            self.hits += 1
+            return value, True
+
+        versioned_key = f'{self.name}:{version}:{key}'
+        value = cache.get(versioned_key)
+        hit = value is not None
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+            value = build()
+            cache.set(versioned_key, value, timeout=self.timeout)
+            logger.info('%s cache miss for %s, hits: %d, misses: %d',
+                        self.name, key, self.hits, self.misses)
+
+        if keep_local:
+            self._local_values[key] = (version, value)
+        return value, hit
+
+
+catalog_cache = VersionedCache('catalog')
+banners_cache = VersionedCache('banners')
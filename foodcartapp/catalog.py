@@ -0,0 +1,118 @@
+import time
+
+from django.utils import timezone
+
+from .caching import banners_cache
+from .models import Banner, Product
+from .payloads import build_payload
+
+
+def dump_price(product):
+    # Decimal is turned into str here, so that the json encoder
+    # does not have to call back into Python for every price
+    return str(product['price'])
+
+
+def dump_category(product):
+    if not product['category_id']:
+        return None
+    return {
+        'id': product['category_id'],
+        'name': product['category__name'],
+    }
+
+
+def dump_image(product):
+    image_storage = Product._meta.get_field('image').storage
+    return image_storage.url(product['image'])
+
+
+def dump_image_srcset(product):
+    image_storage = Product._meta.get_field('image').storage
+    derivatives = product['image_derivatives']
+    if derivatives.get('source') != product['image']:
+        return []
+    return [
+        {
+            'url': image_storage.url(derivative['name']),
+            'width': derivative['width'],
+            'type': derivative['type'],
+        }
+        for derivative in derivatives['srcset']
+    ]
+
+
+def dump_restaurant(product):
+    return {
+        'id': product['id'],
+        'name': product['name'],
+    }
+
+
+PRODUCT_FIELDS = {
+    'id': (['id'], lambda product: product['id']),
+    'name': (['name'], lambda product: product['name']),
+    'price': (['price'], dump_price),
+    'special_status': (['special_status'],
+                       lambda product: product['special_status']),
+    'description': (['description'], lambda product: product['description']),
+    'category': (['category_id', 'category__name'], dump_category),
+    'image': (['image'], dump_image),
+    'image_srcset': (['image', 'image_derivatives'], dump_image_srcset),
+    'restaurant': (['id', 'name'], dump_restaurant),
+}
+
+
+def get_products(fields=PRODUCT_FIELDS, category_id=None, special=None,
+                 after_id=None):
+    columns = {'id'}
+    for field in fields:
+        columns.update(PRODUCT_FIELDS[field][0])
+
+    products = Product.objects.available().order_by('id')
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    if special is not None:
+        products = products.filter(special_status=special)
+    if after_id is not None:
+        products = products.filter(id__gt=after_id)
+    return products.values(*columns)
+
+
+def dump_products(products, fields=PRODUCT_FIELDS):
+    dumpers = [(field, PRODUCT_FIELDS[field][1]) for field in fields]
+    return [
+        {field: dump(product) for field, dump in dumpers}
+        for product in products
+    ]
+
+
+def dump_catalog():
+    return build_payload(dump_products(get_products()))
+
+
+def dump_banners():
+    now = timezone.now()
+    banners = Banner.objects.active(now)
+    payload = build_payload([
+        {
+            'title': banner.title,
+            'src': banner.image.url,
+            'text': banner.text,
+        }
+        for banner in banners
+    ])
+
+    next_change = Banner.objects.next_change_after(now)
+    payload['expires_at'] = next_change.timestamp() if next_change else None
+    return payload
+
+
+def expire_banners():
+    payload, hit = banners_cache.get_or_build('banners', dump_banners)
+    expires_at = payload['expires_at']
+    if expires_at and time.time() >= expires_at:
+        # A banner's window has opened or closed since the payload was built
+        banners_cache.bump()
+        payload, hit = banners_cache.get_or_build('banners', dump_banners)
+    return payload, hit
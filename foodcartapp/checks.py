@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+PROCESS_LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register(Tags.caches, deploy=False)
+def check_shared_cache(app_configs, **kwargs):
+    """Cache versions are bumped by one process and read by the others,
+    including management commands, so they need a cache shared by all
+    the processes of the site."""
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHE_BACKENDS:
+        return []
+    return [Error(
+        f'{backend} is not shared between processes, so catalog and menu '
+        'changes made in one process never reach the others.',
+        hint='Set CACHE_URL to a file, database, Redis or Memcached cache.',
+        obj='CACHES',
+        id='foodcartapp.E001',
+    )]
@@ -0,0 +1,190 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from places.geocoding import get_cached_places
+
+from .locator import restaurant_locator
+from .models import Order, Restaurant
+
+
+def assign_greedily(costs, capacities):
+    """Give every order its cheapest restaurant that still has room,
+    taking the cheapest pairs first."""
+    remaining = dict(capacities)
+    assignment = {}
+    pairs = sorted(
+        (cost, order_id, restaurant_id)
+        for order_id, order_costs in costs.items()
+        for restaurant_id, cost in order_costs.items()
+    )
+    for cost, order_id, restaurant_id in pairs:
+        if order_id in assignment or remaining.get(restaurant_id, 0) <= 0:
+            continue
+        assignment[order_id] = restaurant_id
+        remaining[restaurant_id] -= 1
+    return assignment
+
+
+def improve_locally(assignment, costs, capacities, deadline):
+    """Improve the assignment with relocations, swaps and ejections until
+    no move helps or the deadline passes.
+
+    Every move either assigns one more order or lowers the total cost, so
+    the search always ends.
+    """
+    assignment = dict(assignment)
+    remaining = dict(capacities)
+    orders_by_restaurant = {}
+    for order_id, restaurant_id in assignment.items():
+        remaining[restaurant_id] -= 1
+        orders_by_restaurant.setdefault(restaurant_id, set()).add(order_id)
+
+    def move(order_id, restaurant_id):
+        previous_id = assignment.get(order_id)
+        if previous_id is not None:
+            remaining[previous_id] += 1
+            orders_by_restaurant[previous_id].discard(order_id)
+        assignment[order_id] = restaurant_id
+        remaining[restaurant_id] -= 1
+        orders_by_restaurant.setdefault(restaurant_id, set()).add(order_id)
+
+    def relocate(order_id):
+        """Move the order to a cheaper restaurant with room, or place an
+        unassigned order anywhere with room."""
+        current_id = assignment.get(order_id)
+        current_cost = costs[order_id].get(current_id, float('inf'))
+        best_id = min(
+            (restaurant_id for restaurant_id, cost in costs[order_id].items()
+             if cost < current_cost and remaining.get(restaurant_id, 0) > 0),
+            key=costs[order_id].get,
+            default=None,
+        )
+        if best_id is None:
+            return False
+        move(order_id, best_id)
+        return True
+
+    def swap(order_id):
+        """Exchange restaurants with another order if it is cheaper."""
+        current_id = assignment[order_id]
+        order_costs = costs[order_id]
+        for restaurant_id, cost in order_costs.items():
+            if restaurant_id == current_id:
+                continue
+            for other_id in orders_by_restaurant.get(restaurant_id, ()):
+                other_cost = costs[other_id].get(current_id)
+                if other_cost is None:
+                    continue
+                gain = order_costs[current_id] \
+                    + costs[other_id][restaurant_id] - cost - other_cost
+                if gain > 1e-9:
+                    move(order_id, restaurant_id)
+                    move(other_id, current_id)
+                    return True
+        return False
+
+    def eject(order_id):
+        """Make room for an unassigned order by moving an assigned order
+        from a full restaurant to another one with room."""
+        for restaurant_id in sorted(costs[order_id], key=costs[order_id].get):
+            for other_id in orders_by_restaurant.get(restaurant_id, ()):
+                for other_restaurant_id in costs[other_id]:
+                    if other_restaurant_id != restaurant_id \
+                            and remaining.get(other_restaurant_id, 0) > 0:
+                        move(other_id, other_restaurant_id)
+                        move(order_id, restaurant_id)
+                        return True
+        return False
+
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for order_id in costs:
+            if time.monotonic() >= deadline:
+                break
+            if order_id not in assignment:
+                improved |= relocate(order_id) or eject(order_id)
+            else:
+                improved |= relocate(order_id) or swap(order_id)
+    return assignment
+
+
+def optimize_assignment(costs, capacities, time_budget):
+    """Assign orders to restaurants with a low total cost.
+
+    `costs` maps an order id to the costs of the restaurants that can take
+    it, and `capacities` maps a restaurant id to the number of orders it
+    can still take. Returns a mapping of order ids to restaurant ids;
+    orders that do not fit anywhere are left out.
+    """
+    deadline = time.monotonic() + time_budget
+    assignment = assign_greedily(costs, capacities)
+    return improve_locally(assignment, costs, capacities, deadline)
+
+
+def plan_dispatch(time_budget=None):
+    """Plan which restaurant cooks every order in processing.
+
+    Returns the restaurant id and the distance in km for every assigned
+    order id, and the ids of the orders left for the managers.
+    """
+    if time_budget is None:
+        time_budget = settings.DISPATCH_TIME_BUDGET
+
+    orders = list(
+        Order.objects
+        .filter(status='proc', restaurant__isnull=True)
+        .prefetch_related('order_items')
+    )
+    capacities = {
+        restaurant.id: max(restaurant.dispatch_capacity
+                           - restaurant.orders_in_work, 0)
+        for restaurant in Restaurant.objects.annotate(
+            orders_in_work=Count('order', filter=Q(order__status='cook')))
+    }
+    places = get_cached_places({order.address for order in orders})
+
+    costs = {}
+    with restaurant_locator.pinned():
+        for order in orders:
+            place = places.get(order.address)
+            if not place or place.lat is None:
+                continue
+            costs[order.id] = dict(restaurant_locator.nearest(
+                (place.lat, place.lon),
+                [item.product_id for item in order.order_items.all()],
+                k=settings.DISPATCH_CANDIDATES,
+                radius_km=settings.MANAGER_ORDERS_RESTAURANTS_RADIUS_KM,
+            ))
+
+    assignment = optimize_assignment(costs, capacities, time_budget)
+    return {
+        'assignment': assignment,
+        'kms': {
+            order_id: costs[order_id][restaurant_id]
+            for order_id, restaurant_id in assignment.items()
+        },
+        'unassigned_ids': [order.id for order in orders
+                           if order.id not in assignment],
+    }
+
+
+@transaction.atomic
+def apply_dispatch(plan):
+    """Assign the planned restaurants and start cooking. Orders that were
+    assigned by hand in the meantime are kept as they are."""
+    order_ids_by_restaurant = {}
+    for order_id, restaurant_id in plan['assignment'].items():
+        order_ids_by_restaurant.setdefault(restaurant_id, []).append(order_id)
+
+    assigned_count = 0
+    for restaurant_id, order_ids in order_ids_by_restaurant.items():
+        assigned_count += (
+            Order.objects
+            .filter(id__in=order_ids, status='proc', restaurant__isnull=True)
+            .update(restaurant_id=restaurant_id, status='cook')
+        )
+    return assigned_count
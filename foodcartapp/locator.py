@@ -0,0 +1,240 @@
+import contextlib
+import itertools
+import math
+import threading
+
+from places.distances import measure_distances
+from places.geocoding import get_cached_places
+
+from .availability import availability_index
+from .caching import VersionedCache
+from .models import Restaurant
+
+
+locations_cache = VersionedCache('restaurant_locations')
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Ellipsoidal distances differ from the spherical ones the grid is built on
+# by less than this share
+SPHERE_ERROR = 0.005
+
+
+def to_cartesian(lat, lon):
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (
+        EARTH_RADIUS_KM * math.cos(lat) * math.cos(lon),
+        EARTH_RADIUS_KM * math.cos(lat) * math.sin(lon),
+        EARTH_RADIUS_KM * math.sin(lat),
+    )
+
+
+def get_ring_size(ring):
+    return (2 * ring + 1) ** 3 - max(2 * ring - 1, 0) ** 3
+
+
+def iter_ring(center, ring):
+    """Cells of the cube shell `ring` cells away from the center cell."""
+    x, y, z = center
+    span = range(-ring, ring + 1)
+    for dx, dy in itertools.product(span, span):
+        if abs(dx) == ring or abs(dy) == ring:
+            dzs = span
+        else:
+            dzs = (-ring, ring) if ring else (0,)
+        for dz in dzs:
+            yield x + dx, y + dy, z + dz
+
+
+class RestaurantLocator:
+    """In-memory grid of restaurant coordinates for nearest-restaurant search.
+
+    Points are placed on the Earth's surface in 3D and bucketed into cubic
+    cells. Every point outside the cells within `ring` of the origin's cell
+    is then at least `ring * cell_km` away, so the search looks at the
+    cells ring by ring and stops as soon as no farther cell can hold a
+    closer restaurant. The grid has no seams at the poles or at the 180th
+    meridian.
+
+    Like the availability index, the process that changes a restaurant
+    updates its grid in place and bumps the shared version; other
+    processes rebuild theirs on the next lookup, or once for a whole
+    `pinned()` block.
+    """
+
+    def __init__(self, cell_km=5):
+        self.cell_km = cell_km
+        self._lock = threading.Lock()
+        self._pinned = threading.local()
+        self._version = None
+        self._points = {}
+        self._cells = {}
+
+    def _get_cell(self, point):
+        return tuple(
+            math.floor(coordinate / self.cell_km)
+            for coordinate in to_cartesian(*point)
+        )
+
+    def load(self, points, version=None):
+        """Fill the grid from a mapping of restaurant ids to (lat, lon)."""
+        cells = {}
+        for restaurant_id, point in points.items():
+            cells.setdefault(self._get_cell(point), set()).add(restaurant_id)
+        self._points = dict(points)
+        self._cells = cells
+        self._version = version
+
+    def update_restaurants(self, points):
+        """Move restaurants to new (lat, lon) points, or drop the ones whose
+        point is None."""
+        restaurant_points = dict(self._points)
+        cells = dict(self._cells)
+        for restaurant_id, point in points.items():
+            previous_point = restaurant_points.pop(restaurant_id, None)
+            if previous_point:
+                cell = self._get_cell(previous_point)
+                cells[cell] = cells[cell] - {restaurant_id}
+                if not cells[cell]:
+                    del cells[cell]
+            if point:
+                restaurant_points[restaurant_id] = point
+                cell = self._get_cell(point)
+                cells[cell] = cells.get(cell, set()) | {restaurant_id}
+        self._points = restaurant_points
+        self._cells = cells
+
+    def _fetch_points(self, restaurants):
+        places = get_cached_places(
+            {restaurant.address for restaurant in restaurants})
+        points = {}
+        for restaurant in restaurants:
+            place = places.get(restaurant.address)
+            if place and place.lat is not None and place.lon is not None:
+                points[restaurant.id] = (place.lat, place.lon)
+        return points
+
+    def _build(self, version):
+        restaurants = Restaurant.objects.only('id', 'address')
+        self.load(self._fetch_points(restaurants), version=version)
+
+    def _ensure_fresh(self):
+        if getattr(self._pinned, 'depth', 0):
+            return
+        version = locations_cache.get_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._build(version)
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """Check the locations version once and serve the lookups of the
+        current thread inside the block from memory only. The availability
+        index that `nearest()` filters with is pinned as well."""
+        with availability_index.pinned():
+            self._ensure_fresh()
+            self._pinned.depth = getattr(self._pinned, 'depth', 0) + 1
+            try:
+                yield self
+            finally:
+                self._pinned.depth -= 1
+
+    def refresh_restaurants(self, restaurant_ids):
+        restaurant_ids = set(restaurant_ids)
+        points = dict.fromkeys(restaurant_ids)
+        points.update(self._fetch_points(
+            Restaurant.objects.filter(id__in=restaurant_ids)
+            .only('id', 'address')
+        ))
+        with self._lock:
+            self.update_restaurants(points)
+
+            was_fresh = self._version == locations_cache.get_version()
+            locations_cache.bump()
+            if was_fresh:
+                self._version = locations_cache.get_version()
+
+    def refresh_addresses(self, addresses):
+        restaurant_ids = list(
+            Restaurant.objects
+            .filter(address__in=addresses)
+            .values_list('id', flat=True)
+        )
+        if restaurant_ids:
+            self.refresh_restaurants(restaurant_ids)
+
+    def located(self, restaurant_ids):
+        """Those of the restaurants whose coordinates are known."""
+        self._ensure_fresh()
+        return {restaurant_id for restaurant_id in restaurant_ids
+                if restaurant_id in self._points}
+
+    def _iter_rings(self, center):
+        cells = self._cells
+        ring = 0
+        # Walking empty space cell by cell only pays off while a ring is
+        # smaller than the number of occupied cells
+        while get_ring_size(ring) <= len(cells):
+            yield ring, [cell for cell in iter_ring(center, ring)
+                         if cell in cells]
+            ring += 1
+
+        def get_ring(cell):
+            return max(abs(a - b) for a, b in zip(cell, center))
+
+        farther_cells = sorted(
+            (cell for cell in cells if get_ring(cell) >= ring), key=get_ring)
+        for ring, ring_cells in itertools.groupby(farther_cells, key=get_ring):
+            yield ring, list(ring_cells)
+
+    def nearest(self, point, product_ids=None, k=None, radius_km=None):
+        """The k restaurants nearest to the (lat, lon) point, as a list of
+        (restaurant id, km) pairs from the nearest one.
+
+        With `product_ids` only the restaurants that have all the products
+        for sale are looked at. Restaurants farther than `radius_km` are
+        left out.
+        """
+        self._ensure_fresh()
+        allowed_ids = None
+        if product_ids is not None:
+            allowed_ids = availability_index.restaurants_for(product_ids)
+            if not allowed_ids:
+                return []
+
+        restaurant_points = self._points
+        cells = self._cells
+        found = []
+        for ring, ring_cells in self._iter_rings(self._get_cell(point)):
+            # Nothing in this ring or farther is closer than that
+            closest_km = max(ring - 1, 0) * self.cell_km * (1 - SPHERE_ERROR)
+            if radius_km is not None and closest_km > radius_km:
+                break
+            if k and len(found) >= k and found[k - 1][1] <= closest_km:
+                break
+
+            restaurant_ids = [
+                restaurant_id
+                for cell in ring_cells
+                for restaurant_id in cells[cell]
+                if allowed_ids is None or restaurant_id in allowed_ids
+            ]
+            if not restaurant_ids:
+                continue
+            kms = measure_distances(
+                point,
+                [restaurant_points[restaurant_id]
+                 for restaurant_id in restaurant_ids])
+            found.extend(
+                (restaurant_id, float(km))
+                for restaurant_id, km in zip(restaurant_ids, kms)
+                if radius_km is None or km <= radius_km
+            )
+            found.sort(key=lambda restaurant: (restaurant[1], restaurant[0]))
+
+        return found[:k] if k else found
+
+
+restaurant_locator = RestaurantLocator()
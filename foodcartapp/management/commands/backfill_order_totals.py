@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сохранённую стоимость заказов по их позициям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='только найти заказы с неверной стоимостью')
+
+    def handle(self, *args, **options):
+        mismatched_orders = (
+            Order.objects
+            .with_items_price()
+            .exclude(total_price=F('items_price'))
+        )
+        mismatched_ids = list(mismatched_orders.values_list('id', flat=True))
+
+        if options['verify']:
+            for order in mismatched_orders:
+                self.stdout.write(
+                    f'Заказ #{order.id}: сохранено {order.total_price}, '
+                    f'по позициям {order.items_price}'
+                )
+            self.stdout.write(f'Заказов с неверной стоимостью: '
+                              f'{len(mismatched_ids)}')
+            return
+
+        updated = Order.objects.filter(pk__in=mismatched_ids) \
+            .update_total_prices()
+        self.stdout.write(f'Пересчитано заказов: {updated}')
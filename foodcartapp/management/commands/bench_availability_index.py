@@ -0,0 +1,121 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.availability import AvailabilityIndex, availability_cache
+
+
+def make_menu_items(restaurants_count, products_count, density, seed):
+    random_generator = random.Random(seed)
+    return [
+        (restaurant_id, product_id)
+        for restaurant_id in range(1, restaurants_count + 1)
+        for product_id in range(1, products_count + 1)
+        if random_generator.random() < density
+    ]
+
+
+def make_orders(products_count, count, seed):
+    random_generator = random.Random(seed)
+    return [
+        random_generator.sample(range(1, products_count + 1),
+                                random_generator.randint(1, 5))
+        for _ in range(count)
+    ]
+
+
+def group_by_product(menu_items):
+    restaurant_ids_by_product = {}
+    for restaurant_id, product_id in menu_items:
+        restaurant_ids_by_product.setdefault(product_id, set()) \
+            .add(restaurant_id)
+    return restaurant_ids_by_product
+
+
+def match_with_sets(restaurant_ids_by_product, orders):
+    return [
+        set.intersection(*[
+            restaurant_ids_by_product.get(product_id, set())
+            for product_id in product_ids
+        ])
+        for product_ids in orders
+    ]
+
+
+def match_with_index(index, orders):
+    # As on the orders page, the index version is checked once for all
+    # the orders
+    with index.pinned():
+        return [index.restaurants_for(product_ids) for product_ids in orders]
+
+
+def measure(func, *args, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started_at)
+    return result, best
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает подбор ресторанов по индексу с пересечением множеств'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--density', type=float, default=0.3,
+                            help='Доля товаров в меню каждого ресторана')
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        restaurants_count = options['restaurants']
+        products_count = options['products']
+        repeat = options['repeat']
+        seed = options['seed']
+
+        menu_items = make_menu_items(restaurants_count, products_count,
+                                     options['density'], seed)
+        orders = make_orders(products_count, options['orders'], seed)
+        self.stdout.write(f'Ресторанов: {restaurants_count}, '
+                          f'товаров: {products_count}, '
+                          f'позиций меню: {len(menu_items)}, '
+                          f'заказов: {len(orders)}')
+
+        index = AvailabilityIndex()
+        _, load_time = measure(
+            index.load, range(1, restaurants_count + 1), menu_items,
+            availability_cache.get_version(), repeat=repeat)
+
+        restaurant_ids_by_product, group_time = measure(
+            group_by_product, menu_items, repeat=repeat)
+        by_sets, sets_time = measure(match_with_sets,
+                                     restaurant_ids_by_product, orders,
+                                     repeat=repeat)
+        by_index, index_time = measure(match_with_index, index, orders,
+                                       repeat=repeat)
+        if by_sets != by_index:
+            self.stderr.write('Результаты подбора не совпадают')
+            return
+
+        changed_product_ids = list(range(1, 11))
+        changed_menu_items = [
+            (restaurant_id, product_id)
+            for restaurant_id, product_id in menu_items
+            if product_id in changed_product_ids
+        ]
+        _, update_time = measure(index.update_products, changed_product_ids,
+                                 changed_menu_items, repeat=repeat)
+
+        rows = [
+            ('построение индекса', load_time),
+            ('построение множеств', group_time),
+            ('пересечение множеств', sets_time),
+            ('поиск по индексу', index_time),
+            ('обновление 10 товаров', update_time),
+        ]
+        for name, elapsed in rows:
+            self.stdout.write(f'{name:<24} {elapsed * 1000:>10.2f} мс')
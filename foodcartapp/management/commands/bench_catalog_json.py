@@ -0,0 +1,91 @@
+import gzip
+import time
+from decimal import Decimal
+
+import brotli
+from django.core.management.base import BaseCommand
+
+from foodcartapp.catalog import dump_price
+from foodcartapp.payloads import BROTLI_QUALITY, GZIP_LEVEL, encode_json
+
+
+def make_products(count):
+    return [
+        {
+            'id': product_id,
+            'name': f'Бургер №{product_id}',
+            'price': Decimal(f'{100 + product_id % 900}.00'),
+            'special_status': product_id % 10 == 0,
+            'description': 'Сочная котлета, свежие овощи и фирменный соус. ' * 3,
+            'category': {
+                'id': product_id % 7,
+                'name': f'Категория {product_id % 7}',
+            },
+            'image': f'/media/burger-{product_id}.jpg',
+            'restaurant': {
+                'id': product_id,
+                'name': f'Бургер №{product_id}',
+            },
+        }
+        for product_id in range(1, count + 1)
+    ]
+
+
+def encode_indented(products):
+    return encode_json(products, compact=False)
+
+
+def encode_compact(products):
+    # The catalog turns prices into strings before encoding
+    products = [{**product, 'price': dump_price(product)}
+                for product in products]
+    return encode_json(products, compact=True)
+
+
+def measure(func, *args, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started_at)
+    return result, best
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает размер и время кодирования ответа /api/products/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        self.stdout.write(
+            f'{"товаров":>8} {"вариант":<16} {"байт":>10} {"мс":>9}')
+        for size in options['sizes']:
+            products = make_products(size)
+
+            indented, indented_time = measure(encode_indented, products,
+                                              repeat=repeat)
+            compact, compact_time = measure(encode_compact, products,
+                                            repeat=repeat)
+            gzipped, gzip_time = measure(
+                lambda content: gzip.compress(content,
+                                              compresslevel=GZIP_LEVEL),
+                compact, repeat=repeat)
+            brotlied, brotli_time = measure(
+                lambda content: brotli.compress(content,
+                                                quality=BROTLI_QUALITY,
+                                                mode=brotli.MODE_TEXT),
+                compact, repeat=repeat)
+
+            rows = [
+                ('indent=4', indented, indented_time),
+                ('compact', compact, compact_time),
+                ('compact+gzip', gzipped, compact_time + gzip_time),
+                ('compact+br', brotlied, compact_time + brotli_time),
+            ]
+            for name, content, elapsed in rows:
+                self.stdout.write(f'{size:>8} {name:<16} {len(content):>10} '
+                                  f'{elapsed * 1000:>9.2f}')
@@ -0,0 +1,110 @@
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.availability import AvailabilityIndex, availability_cache
+from foodcartapp.models import Product, RestaurantMenuItem
+
+
+def make_menu_items(restaurants_count, products_count, density, seed):
+    random_generator = random.Random(seed)
+    return [
+        (restaurant_id, product_id)
+        for restaurant_id in range(1, restaurants_count + 1)
+        for product_id in range(1, products_count + 1)
+        if random_generator.random() < density
+    ]
+
+
+def build_with_models(restaurant_ids, product_ids, menu_items):
+    """Rows shaped like the ones view_products used to build: a model
+    instance for every product and menu item, and a dict and a list per
+    product. The instances are unsaved and built in memory, so the queries
+    and prefetching of the old view are not measured here."""
+    products = [
+        Product(id=product_id, name=f'Бургер №{product_id}', price=100,
+                image=f'burger-{product_id}.jpg')
+        for product_id in product_ids
+    ]
+    menu_items_by_product = {}
+    for restaurant_id, product_id in menu_items:
+        menu_items_by_product.setdefault(product_id, []).append(
+            RestaurantMenuItem(restaurant_id=restaurant_id,
+                               product_id=product_id))
+
+    rows = []
+    for product in products:
+        availability = {
+            item.restaurant_id: item.availability
+            for item in menu_items_by_product.get(product.id, [])
+        }
+        rows.append((product, [
+            (restaurant_id, availability.get(restaurant_id, False))
+            for restaurant_id in restaurant_ids
+        ]))
+    return rows
+
+
+def build_index(restaurant_ids, menu_items):
+    index = AvailabilityIndex()
+    index.load(restaurant_ids, menu_items, availability_cache.get_version())
+    return index
+
+
+def measure(func, *args):
+    """Time of the call, and peak and retained memory of a second call
+    made under tracemalloc, which slows it down several times."""
+    started_at = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started_at
+
+    tracemalloc.start()
+    result = func(*args)
+    retained_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak_memory, retained_memory
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает память и время построения таблицы наличия товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=200)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--density', type=float, default=0.5,
+                            help='Доля товаров в меню каждого ресторана')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        restaurant_ids = list(range(1, options['restaurants'] + 1))
+        product_ids = list(range(1, options['products'] + 1))
+        menu_items = make_menu_items(len(restaurant_ids), len(product_ids),
+                                     options['density'], options['seed'])
+        self.stdout.write(f'Ресторанов: {len(restaurant_ids)}, '
+                          f'товаров: {len(product_ids)}, '
+                          f'позиций меню: {len(menu_items)}')
+
+        page_product_ids = product_ids[:options['page_size']]
+        index = build_index(restaurant_ids, menu_items)
+        rows = [
+            ('модели без БД, таблица', measure(
+                build_with_models, restaurant_ids, product_ids, menu_items)),
+            ('индекс, построение', measure(
+                build_index, restaurant_ids, menu_items)),
+            ('индекс, страница', measure(
+                lambda: list(index.iter_availability_rows(
+                    page_product_ids, restaurant_ids)))),
+            ('индекс, все строки', measure(
+                lambda: sum(1 for _ in index.iter_availability_rows(
+                    product_ids, restaurant_ids)))),
+        ]
+
+        self.stdout.write(f'{"вариант":<24} {"мс":>10} {"пик, МБ":>9} '
+                          f'{"остаётся, МБ":>13}')
+        for name, (_, elapsed, peak_memory, retained_memory) in rows:
+            self.stdout.write(f'{name:<24} {elapsed * 1000:>10.1f} '
+                              f'{peak_memory / 2 ** 20:>9.1f} '
+                              f'{retained_memory / 2 ** 20:>13.1f}')
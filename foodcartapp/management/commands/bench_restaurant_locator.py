@@ -0,0 +1,101 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from foodcartapp.locator import RestaurantLocator, locations_cache
+from places.distances import measure_distances
+
+
+def make_points(count, random_generator):
+    return [
+        (55.75 + random_generator.uniform(-0.5, 0.5),
+         37.62 + random_generator.uniform(-0.8, 0.8))
+        for _ in range(count)
+    ]
+
+
+def find_by_scan(points, queries, k, radius_km):
+    results = []
+    for query in queries:
+        kms = measure_distances(query, points)
+        nearest = np.argsort(kms, kind='stable')[:k]
+        results.append([int(index) + 1 for index in nearest
+                        if kms[index] <= radius_km])
+    return results
+
+
+def find_by_locator(locator, queries, k, radius_km):
+    return [
+        [restaurant_id for restaurant_id, _
+         in locator.nearest(query, k=k, radius_km=radius_km)]
+        for query in queries
+    ]
+
+
+def measure(func, *args, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started_at)
+    return result, best
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск ближайших ресторанов по сетке с полным перебором'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10, 1000, 50000])
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('-k', type=int, default=5)
+        parser.add_argument('--radius', type=float, default=10,
+                            help='Радиус поиска в км')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        k = options['k']
+        radius_km = options['radius']
+        repeat = options['repeat']
+        self.stdout.write(
+            f'{"ресторанов":>10} {"построение, мс":>15} '
+            f'{"перебор, мкс":>13} {"сетка, мкс":>11} '
+            f'{"обновление, мкс":>16}')
+        for size in options['sizes']:
+            random_generator = random.Random(options['seed'])
+            points = make_points(size, random_generator)
+            queries = make_points(options['queries'], random_generator)
+
+            locator = RestaurantLocator()
+            _, build_time = measure(
+                locator.load,
+                dict(enumerate(points, start=1)),
+                locations_cache.get_version(),
+                repeat=repeat)
+
+            by_scan, scan_time = measure(find_by_scan, points, queries, k,
+                                         radius_km, repeat=repeat)
+            by_locator, locator_time = measure(find_by_locator, locator,
+                                               queries, k, radius_km,
+                                               repeat=repeat)
+            mismatches = sum(
+                scan_ids != locator_ids
+                for scan_ids, locator_ids in zip(by_scan, by_locator))
+            if mismatches:
+                self.stderr.write(f'Результаты не совпали в {mismatches} '
+                                  f'запросах из {len(queries)}')
+
+            _, update_time = measure(
+                locator.update_restaurants,
+                {1: make_points(1, random_generator)[0]},
+                repeat=repeat)
+
+            per_query = 1_000_000 / len(queries)
+            self.stdout.write(
+                f'{size:>10} {build_time * 1000:>15.2f} '
+                f'{scan_time * per_query:>13.1f} '
+                f'{locator_time * per_query:>11.1f} '
+                f'{update_time * 1_000_000:>16.1f}')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from foodcartapp.caching import catalog_cache
+from foodcartapp.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Сверяет флаг «есть в продаже» товаров с меню ресторанов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='исправить найденные расхождения')
+
+    def handle(self, *args, **options):
+        mismatched_products = (
+            Product.objects
+            .with_menu_availability()
+            .exclude(is_available=F('menu_availability'))
+        )
+        mismatched_ids = []
+        for product in mismatched_products:
+            mismatched_ids.append(product.id)
+            self.stdout.write(
+                f'{product.name} (#{product.id}): сохранено '
+                f'{product.is_available}, по меню {product.menu_availability}'
+            )
+        self.stdout.write(f'Товаров с расхождениями: {len(mismatched_ids)}')
+
+        if options['fix'] and mismatched_ids:
+            Product.objects.filter(pk__in=mismatched_ids) \
+                .refresh_availability()
+            catalog_cache.bump()
+            self.stdout.write('Расхождения исправлены')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.dispatch import apply_dispatch, plan_dispatch
+
+
+class Command(BaseCommand):
+    help = 'Распределяет заказы в обработке по ближайшим ресторанам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--time-budget', type=float,
+                            help='Сколько секунд искать распределение')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать распределение')
+
+    def handle(self, *args, **options):
+        plan = plan_dispatch(time_budget=options['time_budget'])
+        for order_id, restaurant_id in sorted(plan['assignment'].items()):
+            self.stdout.write(f'Заказ {order_id} → ресторан {restaurant_id}, '
+                              f'{plan["kms"][order_id]:.3f} км')
+
+        self.stdout.write(
+            f'Суммарное расстояние: {sum(plan["kms"].values()):.1f} км, '
+            f'не распределено заказов: {len(plan["unassigned_ids"])}')
+        if options['dry_run']:
+            return
+        assigned_count = apply_dispatch(plan)
+        self.stdout.write(f'Назначено заказов: {assigned_count}')
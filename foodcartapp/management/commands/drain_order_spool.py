@@ -0,0 +1,90 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from foodcartapp.models import IdempotencyKey
+from foodcartapp.serializers import save_orders
+from foodcartapp.spool import get_order_spool
+
+
+def drain_batch(spool, batch_size):
+    claim, tickets = spool.take(batch_size)
+    if not tickets:
+        return 0
+
+    keys = {f'spool:{ticket}': ticket for ticket, _ in tickets}
+    with transaction.atomic():
+        # The keys are saved together with the orders, so a batch that was
+        # saved but not marked in the spool is not saved twice after a crash.
+        saved_results = {
+            keys[idempotency_key.key]: idempotency_key.response_body
+            for idempotency_key in IdempotencyKey.objects.filter(key__in=keys)
+        }
+        # A ticket claimed again after its claim expired may still be saved
+        # by the worker that claimed it first. The key of every ticket is
+        # inserted before its order, and the tickets whose key has been
+        # taken by the other worker are left to it.
+        IdempotencyKey.objects.bulk_create(
+            [
+                IdempotencyKey(key=key, fingerprint=claim)
+                for key, ticket in keys.items()
+                if ticket not in saved_results
+            ],
+            ignore_conflicts=True,
+        )
+        own_keys = {
+            idempotency_key.key: idempotency_key
+            for idempotency_key in IdempotencyKey.objects.filter(
+                key__in=keys, fingerprint=claim)
+        }
+        new_tickets = [
+            (ticket, payload) for ticket, payload in tickets
+            if f'spool:{ticket}' in own_keys
+        ]
+        new_results = save_orders([payload for _, payload in new_tickets])
+
+        new_keys = []
+        for (ticket, _), result in zip(new_tickets, new_results):
+            idempotency_key = own_keys[f'spool:{ticket}']
+            idempotency_key.response_status = \
+                400 if 'errors' in result else 200
+            idempotency_key.response_body = result
+            new_keys.append(idempotency_key)
+            saved_results[ticket] = result
+        IdempotencyKey.objects.bulk_update(
+            new_keys, ['response_status', 'response_body'])
+
+    spool.complete([
+        (ticket, 'failed' if 'errors' in result else 'done', result)
+        for ticket, result in saved_results.items()
+    ])
+    return len(saved_results)
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет в базу заказы, принятые в асинхронном режиме'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1,
+                            help='пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='разобрать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        spool = get_order_spool()
+        while True:
+            started_at = time.monotonic()
+            drained = drain_batch(spool, options['batch_size'])
+            if drained:
+                elapsed = time.monotonic() - started_at
+                stats = spool.stats()
+                self.stdout.write(
+                    f'Сохранено заказов: {drained} за {elapsed:.3f} с, '
+                    f'в очереди: {stats["depth"]}'
+                )
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
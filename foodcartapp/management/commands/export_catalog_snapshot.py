@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodcartapp.snapshots import export_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет ответы /api/products/ и /api/banners/ в STATIC_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=3,
+                            help='сколько последних выгрузок хранить')
+        parser.add_argument('--interval', type=float,
+                            help='выгружать каталог заново каждые N секунд')
+
+    def handle(self, *args, **options):
+        if options['keep'] < 1:
+            raise CommandError('--keep должен быть не меньше 1')
+
+        while True:
+            directory = export_snapshot(keep=options['keep'])
+            if directory:
+                self.stdout.write(f'Каталог выгружен в {directory}')
+            elif not options['interval']:
+                self.stdout.write('Каталог не изменился с прошлой выгрузки')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.models import Product
+from foodcartapp.thumbnails import generate_product_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии картинок товаров в WebP и JPEG/PNG'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='пересоздать копии у всех товаров')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only(
+            'id', 'image', 'image_derivatives')
+
+        generated = 0
+        for product in products.iterator():
+            source = product.image_derivatives.get('source')
+            if source == product.image.name and not options['force']:
+                continue
+            try:
+                if generate_product_derivatives(product.id):
+                    generated += 1
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{product.image.name}: {error}')
+        self.stdout.write(f'Обработано картинок: {generated}')
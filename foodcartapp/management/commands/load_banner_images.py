@@ -0,0 +1,29 @@
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from foodcartapp.models import Banner
+
+
+class Command(BaseCommand):
+    help = 'Копирует недостающие картинки баннеров из assets в MEDIA_ROOT'
+
+    def handle(self, *args, **options):
+        storage = Banner._meta.get_field('image').storage
+        for banner in Banner.objects.exclude(image=''):
+            if storage.exists(banner.image.name):
+                continue
+
+            path = os.path.join(settings.BASE_DIR, 'assets',
+                                os.path.basename(banner.image.name))
+            if not os.path.exists(path):
+                self.stdout.write(
+                    f'Нет картинки для баннера «{banner.title}»: {path}')
+                continue
+
+            with open(path, 'rb') as image:
+                storage.save(banner.image.name, File(image))
+            self.stdout.write(
+                f'Картинка баннера «{banner.title}» сохранена')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.spool import get_order_spool
+
+
+class Command(BaseCommand):
+    help = 'Показывает глубину очереди асинхронных заказов и скорость разбора'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=60,
+                            help='окно для подсчёта скорости, в секундах')
+        parser.add_argument('--purge-older-than', type=int,
+                            help='удалить разобранные заявки старше N секунд')
+
+    def handle(self, *args, **options):
+        spool = get_order_spool()
+        if options['purge_older_than'] is not None:
+            purged = spool.purge(options['purge_older_than'])
+            self.stdout.write(f'Удалено заявок: {purged}')
+
+        stats = spool.stats(window=options['window'])
+        self.stdout.write(f'queue_depth {stats["depth"]}')
+        self.stdout.write(f'queue_oldest_age_seconds {stats["oldest_age"]:.3f}')
+        self.stdout.write(f'drain_rate_per_second {stats["drain_rate"]:.3f}')
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:27
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def fill_is_available(apps, schema_editor):
+    Product = apps.get_model('foodcartapp', 'Product')
+    RestaurantMenuItem = apps.get_model('foodcartapp', 'RestaurantMenuItem')
+    Product.objects.update(is_available=Exists(
+        RestaurantMenuItem.objects.filter(product=OuterRef('pk'),
+                                          availability=True)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0054_order_total_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='is_available',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='есть в продаже'),
+        ),
+        migrations.RunPython(fill_is_available, migrations.RunPython.noop),
+    ]
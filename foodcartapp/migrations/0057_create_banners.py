@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+BANNERS = [
+    ('Burger', 'burger.jpg', 'Tasty Burger at your door step'),
+    ('Spices', 'food.jpg', 'All Cuisines'),
+    ('New York', 'tasty.jpg', 'Food is incomplete without a tasty dessert'),
+]
+
+
+def create_banners(apps, schema_editor):
+    # The images are copied to the media storage by the load_banner_images
+    # command, a migration does not touch files
+    Banner = apps.get_model('foodcartapp', 'Banner')
+    Banner.objects.bulk_create([
+        Banner(title=title,
+               text=text,
+               image=f'banners/{filename}',
+               order=order)
+        for order, (title, filename, text) in enumerate(BANNERS)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0056_banner'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_banners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0057_create_banners'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_derivatives',
+            field=models.JSONField(default=dict, editable=False, verbose_name='уменьшенные копии картинки'),
+        ),
+    ]
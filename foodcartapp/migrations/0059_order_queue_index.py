@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0058_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-status', 'created_at', 'id'], name='order_queue_idx'),
+        ),
+    ]
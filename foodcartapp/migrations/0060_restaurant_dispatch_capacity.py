@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0059_order_queue_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='dispatch_capacity',
+            field=models.PositiveSmallIntegerField(default=10, help_text='Больше заказов при автоматическом распределении ресторану не назначается', verbose_name='сколько заказов готовит одновременно'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+def fill_empty_status(apps, schema_editor):
+    # Orders from the site were saved without a status
+    Order = apps.get_model('foodcartapp', 'Order')
+    Order.objects.filter(status='').update(status='proc')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0060_restaurant_dispatch_capacity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('proc', 'В обработке'), ('cook', 'Готовится'), ('dlvr', 'Передан в доставку'), ('end', 'Завершен')], default='proc', max_length=4, verbose_name='Статус'),
+        ),
+        migrations.RunPython(fill_empty_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:02
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0061_order_status_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.IntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='количество'),
+        ),
+    ]
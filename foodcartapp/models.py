@@ -1,7 +1,15 @@
-from django.db import models
+import datetime
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models, transaction
+from django.dispatch import Signal
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
-from django.db.models import F, Sum
+from django.db.models import Exists, F, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 
 
 class Restaurant(models.Model):
@@ -19,6 +27,12 @@ class Restaurant(models.Model):
         max_length=50,
         blank=True,
     )
+    dispatch_capacity = models.PositiveSmallIntegerField(
+        'сколько заказов готовит одновременно',
+        default=10,
+        help_text='Больше заказов при автоматическом распределении '
+                  'ресторану не назначается',
+    )
 
     class Meta:
         verbose_name = 'ресторан'
@@ -28,14 +42,45 @@ class Restaurant(models.Model):
         return self.name
 
 
+availability_changed = Signal()
+
+_scheduled_refresh = threading.local()
+
+
+def schedule_availability_refresh(product_ids):
+    """Refresh Product.is_available of the products after commit.
+
+    Product ids collected during a transaction are refreshed with one
+    query, however many menu items were changed.
+    """
+    scheduled_ids = _scheduled_refresh.__dict__.setdefault('product_ids', set())
+    scheduled_ids.update(product_ids)
+    transaction.on_commit(refresh_scheduled_availability)
+
+
+def refresh_scheduled_availability():
+    product_ids = _scheduled_refresh.__dict__.pop('product_ids', None)
+    if not product_ids:
+        return
+    Product.objects.filter(pk__in=product_ids).refresh_availability()
+    availability_changed.send(sender=Product, product_ids=product_ids)
+
+
 class ProductQuerySet(models.QuerySet):
     def available(self):
-        products = (
-            RestaurantMenuItem.objects
-            .filter(availability=True)
-            .values_list('product')
-        )
-        return self.filter(pk__in=products)
+        return self.filter(is_available=True)
+
+    def with_menu_availability(self):
+        return self.annotate(menu_availability=Exists(
+            RestaurantMenuItem.objects.filter(product=OuterRef('pk'),
+                                              availability=True)
+        ))
+
+    def refresh_availability(self):
+        return self.update(is_available=Exists(
+            RestaurantMenuItem.objects.filter(product=OuterRef('pk'),
+                                              availability=True)
+        ))
 
     def available_restaurants(self):
         return self.menu_items.filter(availability=True).restaurant.all()
@@ -77,6 +122,11 @@ class Product(models.Model):
     image = models.ImageField(
         'картинка'
     )
+    image_derivatives = models.JSONField(
+        'уменьшенные копии картинки',
+        default=dict,
+        editable=False,
+    )
     special_status = models.BooleanField(
         'спец.предложение',
         default=False,
@@ -87,6 +137,12 @@ class Product(models.Model):
         max_length=200,
         blank=True,
     )
+    is_available = models.BooleanField(
+        'есть в продаже',
+        default=False,
+        db_index=True,
+        editable=False,
+    )
 
     objects = ProductQuerySet.as_manager()
 
@@ -97,6 +153,101 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # is_available follows the menus and is only written by
+        # refresh_availability(), so a product loaded before a menu change
+        # does not write its stale flag back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'is_available'
+            ]
+        super().save(*args, **kwargs)
+
+
+class RestaurantMenuItemQuerySet(models.QuerySet):
+    # Signals are not sent for bulk operations, so they refresh product
+    # availability themselves. bulk_update is done with update() as well.
+
+    def update(self, **kwargs):
+        menu_items = dict(self.values_list('pk', 'product_id'))
+        updated = super().update(**kwargs)
+
+        product_ids = set(menu_items.values())
+        if 'product' in kwargs or 'product_id' in kwargs:
+            product_ids.update(
+                self.model.objects.filter(pk__in=menu_items)
+                .values_list('product_id', flat=True)
+            )
+        schedule_availability_refresh(product_ids)
+        return updated
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        schedule_availability_refresh({obj.product_id for obj in objs})
+        return objs
+
+    def set_availability(self, changes):
+        """Apply many (restaurant id, product id, availability) changes in
+        one transaction.
+
+        A None restaurant or product id stands for all of them. Menu items
+        are only created for products that become available. Product
+        availability and the catalog caches are refreshed once, after the
+        commit. Returns the numbers of updated and created menu items.
+        """
+        all_restaurant_ids = all_product_ids = None
+        wanted = {}
+        for restaurant_id, product_id, availability in changes:
+            if restaurant_id is None:
+                if all_restaurant_ids is None:
+                    all_restaurant_ids = list(
+                        Restaurant.objects.values_list('id', flat=True))
+                restaurant_ids = all_restaurant_ids
+            else:
+                restaurant_ids = [restaurant_id]
+            if product_id is None:
+                if all_product_ids is None:
+                    all_product_ids = list(
+                        Product.objects.values_list('id', flat=True))
+                product_ids = all_product_ids
+            else:
+                product_ids = [product_id]
+
+            for restaurant_id in restaurant_ids:
+                for product_id in product_ids:
+                    wanted[restaurant_id, product_id] = availability
+
+        with transaction.atomic():
+            menu_items = self.model.objects.select_for_update().filter(
+                restaurant_id__in={key[0] for key in wanted},
+                product_id__in={key[1] for key in wanted},
+            )
+            changed_items = []
+            for menu_item in menu_items:
+                key = (menu_item.restaurant_id, menu_item.product_id)
+                availability = wanted.pop(key, None)
+                if availability is not None \
+                        and menu_item.availability != availability:
+                    menu_item.availability = availability
+                    changed_items.append(menu_item)
+
+            self.model.objects.bulk_update(changed_items, ['availability'],
+                                           batch_size=500)
+            new_items = self.model.objects.bulk_create(
+                [
+                    self.model(restaurant_id=restaurant_id,
+                               product_id=product_id,
+                               availability=True)
+                    for (restaurant_id, product_id), availability
+                    in wanted.items()
+                    if availability
+                ],
+                batch_size=500,
+                ignore_conflicts=True,
+            )
+        return len(changed_items), len(new_items)
+
 
 class RestaurantMenuItem(models.Model):
     restaurant = models.ForeignKey(
@@ -117,6 +268,8 @@ class RestaurantMenuItem(models.Model):
         db_index=True
     )
 
+    objects = RestaurantMenuItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'пункт меню ресторана'
         verbose_name_plural = 'пункты меню ресторана'
@@ -128,10 +281,100 @@ class RestaurantMenuItem(models.Model):
         return f"{self.restaurant.name} - {self.product.name}"
 
 
+class BannerQuerySet(models.QuerySet):
+    def active(self, now):
+        return self.filter(
+            Q(active_from__isnull=True) | Q(active_from__lte=now),
+            Q(active_until__isnull=True) | Q(active_until__gt=now),
+        )
+
+    def next_change_after(self, now):
+        changes = self.aggregate(
+            next_start=Min('active_from', filter=Q(active_from__gt=now)),
+            next_end=Min('active_until', filter=Q(active_until__gt=now)),
+        )
+        upcoming_changes = [change for change in changes.values() if change]
+        return min(upcoming_changes, default=None)
+
+
+class Banner(models.Model):
+    title = models.CharField(
+        'заголовок',
+        max_length=50
+    )
+    text = models.CharField(
+        'текст',
+        max_length=200,
+        blank=True,
+    )
+    image = models.ImageField(
+        'картинка'
+    )
+    order = models.PositiveIntegerField(
+        'порядок',
+        default=0,
+        db_index=True,
+    )
+    active_from = models.DateTimeField(
+        'показывать с',
+        null=True,
+        blank=True,
+    )
+    active_until = models.DateTimeField(
+        'показывать до',
+        null=True,
+        blank=True,
+    )
+
+    objects = BannerQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['order', 'id']
+        verbose_name = 'баннер'
+        verbose_name_plural = 'баннеры'
+
+    def __str__(self):
+        return self.title
+
+
 class OrderQuerySet(models.QuerySet):
+    # Orders in processing go first, then the oldest ones
+    QUEUE_ORDERING = ['-status', 'created_at', 'id']
+
     def price(self):
-        return self.annotate(price=Sum(F('order_items__quantity')
-                                       * F('order_items__price_fixed')))
+        return self.annotate(price=F('total_price'))
+
+    def queue(self):
+        return self.order_by(*self.QUEUE_ORDERING)
+
+    def queue_after(self, status, created_at, order_id):
+        """Orders that come after the given one in the queue ordering."""
+        return self.queue().filter(
+            Q(status__lt=status)
+            | Q(status=status, created_at__gt=created_at)
+            | Q(status=status, created_at=created_at, id__gt=order_id)
+        )
+
+    def with_items_price(self):
+        return self.annotate(items_price=Coalesce(
+            Sum(F('order_items__quantity') * F('order_items__price_fixed')),
+            Decimal(0),
+            output_field=models.DecimalField(),
+        ))
+
+    def update_total_prices(self):
+        items_price = (
+            OrderItem.objects
+            .filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(total=Sum(F('quantity') * F('price_fixed')))
+            .values('total')
+        )
+        return self.update(total_price=Coalesce(
+            Subquery(items_price),
+            Decimal(0),
+            output_field=models.DecimalField(),
+        ))
 
 
 class Order(models.Model):
@@ -180,6 +423,7 @@ class Order(models.Model):
 
     status = models.CharField(max_length=4,
                               choices=STATUS_CHOICES,
+                              default='proc',
                               verbose_name='Статус')
 
     comment = models.TextField(blank=True,
@@ -199,6 +443,12 @@ class Order(models.Model):
                                    on_delete=models.SET_NULL,
                                    )
 
+    total_price = models.DecimalField(max_digits=10,
+                                      decimal_places=2,
+                                      default=0,
+                                      editable=False,
+                                      verbose_name='Стоимость заказа')
+
     objects = OrderQuerySet.as_manager()
 
     class Meta:
@@ -207,6 +457,8 @@ class Order(models.Model):
         verbose_name_plural = 'Заказы'
         indexes = [
             models.Index(fields=['status', 'payment_type']),
+            models.Index(fields=['-status', 'created_at', 'id'],
+                         name='order_queue_idx'),
         ]
 
     def __str__(self):
@@ -236,3 +488,38 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.product.name}"
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def expired(self):
+        ttl = datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        return self.filter(created_at__lt=timezone.now() - ttl)
+
+
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=255,
+                           unique=True,
+                           verbose_name='Ключ идемпотентности')
+
+    fingerprint = models.CharField(max_length=64,
+                                   verbose_name='Хэш тела запроса')
+
+    response_status = models.PositiveSmallIntegerField(
+        null=True,
+        verbose_name='Код ответа')
+
+    response_body = models.JSONField(null=True,
+                                     verbose_name='Тело ответа')
+
+    created_at = models.DateTimeField(verbose_name="Дата и время создания",
+                                      auto_now_add=True,
+                                      db_index=True)
+
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+import json
+import time
+
+import brotli
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+ENCODINGS = ['br', 'gzip']
+
+# Payloads are compressed on a cache miss, so levels are picked to keep
+# a 10k products catalog under a hundred milliseconds
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def encode_json(data, compact=None):
+    if compact is None:
+        compact = settings.API_JSON_COMPACT
+    if compact:
+        # Without indent json uses its C encoder, which is several times
+        # faster as long as the data holds no types it has to call back for
+        return json.dumps(data,
+                          cls=DjangoJSONEncoder,
+                          ensure_ascii=False,
+                          separators=(',', ':')).encode()
+    return json.dumps(data,
+                      cls=DjangoJSONEncoder,
+                      ensure_ascii=False,
+                      indent=4).encode()
+
+
+def compress(content):
+    return {
+        'identity': content,
+        'gzip': gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0),
+        'br': brotli.compress(content,
+                              quality=BROTLI_QUALITY,
+                              mode=brotli.MODE_TEXT),
+    }
+
+
+def build_payload(data):
+    content = encode_json(data)
+    if settings.API_PRECOMPRESS:
+        payload = compress(content)
+    else:
+        payload = {'identity': content}
+    payload['etag'] = hashlib.md5(content).hexdigest()
+    payload['built_at'] = time.time()
+    return payload
+
+
+def choose_encoding(accept_encoding, available):
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    for coding in ENCODINGS:
+        quality = accepted.get(coding, accepted.get('*', 0))
+        if coding in available and quality > 0:
+            return coding
+    return 'identity'
@@ -1,8 +1,8 @@
-from django.shortcuts import get_object_or_404
 from phonenumber_field.modelfields import PhoneNumberField
 from rest_framework.serializers import ModelSerializer, Serializer, ValidationError
 from rest_framework.serializers import IntegerField
 
+from places.geocoding import schedule_geocoding
 
 from .models import Order, OrderItem, Product
 
@@ -17,6 +17,17 @@ class ProductsSerializer(Serializer):
         return value
 
 
+def collect_product_ids(payloads):
+    product_ids = set()
+    for payload in payloads:
+        if not isinstance(payload, dict):
+            continue
+        products = ProductsSerializer(data=payload.get('products'), many=True)
+        if products.is_valid():
+            product_ids.update(item['product'] for item in products.validated_data)
+    return product_ids
+
+
 class OrderSerializer(ModelSerializer):
     products = ProductsSerializer(many=True,
                                   write_only=True,
@@ -28,21 +39,84 @@ class OrderSerializer(ModelSerializer):
         fields = ['id', 'firstname', 'lastname',
                   'address', 'phonenumber', 'products']
 
+    def validate_products(self, value):
+        # A batch of orders passes all its products in the context,
+        # so that they are fetched with one query for the whole batch.
+        product_ids = {item['product'] for item in value}
+        products = self.context.get('products')
+        if products is None:
+            products = Product.objects.in_bulk(product_ids)
+
+        missing_ids = sorted(product_ids - products.keys())
+        if missing_ids:
+            raise ValidationError(
+                [f'invalid id {product_id}' for product_id in missing_ids])
+
+        quantities = {}
+        for item in value:
+            product_id = item['product']
+            quantities[product_id] = \
+                quantities.get(product_id, 0) + item['quantity']
+
+        return [
+            {'product': products[product_id], 'quantity': quantity}
+            for product_id, quantity in quantities.items()
+        ]
+
     def create(self, validated_data):
-        order_items = validated_data.pop('products')
-        order = Order.objects.create(**validated_data)
-
-        for order_item in order_items:
-            product_id = order_item['product']
-            quantity = order_item['quantity']
-            product = get_object_or_404(
-                Product, id=product_id)
-
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                price_fixed=product.price
-            )
-
-        return order
+        return create_orders([validated_data])[0]
+
+
+def create_orders(validated_orders):
+    orders_with_items = []
+    for validated_data in validated_orders:
+        order_fields = dict(validated_data)
+        order_items = order_fields.pop('products')
+        order_fields['total_price'] = sum(
+            order_item['product'].price * order_item['quantity']
+            for order_item in order_items
+        )
+        orders_with_items.append((Order(**order_fields), order_items))
+
+    orders = Order.objects.bulk_create(
+        [order for order, _ in orders_with_items])
+
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=order_item['product'],
+            quantity=order_item['quantity'],
+            price_fixed=order_item['product'].price
+        )
+        for order, order_items in orders_with_items
+        for order_item in order_items
+    ])
+    schedule_geocoding(order.address for order in orders)
+
+    return orders
+
+
+def save_orders(payloads):
+    """Validate order payloads together and save the valid ones in bulk.
+
+    Returns the serialized order or the validation errors for every
+    payload, in the same order as the payloads.
+    """
+    products = Product.objects.in_bulk(collect_product_ids(payloads))
+    serializers = [
+        OrderSerializer(data=payload, context={'products': products})
+        for payload in payloads
+    ]
+    valid_serializers = [
+        serializer for serializer in serializers if serializer.is_valid()]
+
+    new_orders = iter(create_orders(
+        [serializer.validated_data for serializer in valid_serializers]))
+
+    results = []
+    for serializer in serializers:
+        if serializer.errors:
+            results.append({'errors': serializer.errors})
+        else:
+            results.append({'order': OrderSerializer(next(new_orders)).data})
+    return results
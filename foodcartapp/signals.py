@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from places.models import coordinates_changed
+
+from .availability import availability_index
+from .caching import banners_cache, catalog_cache
+from .locator import restaurant_locator
+from .models import Banner
+from .models import Product, ProductCategory, Restaurant, RestaurantMenuItem
+from .models import availability_changed, schedule_availability_refresh
+from .thumbnails import schedule_derivatives
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def invalidate_catalog(sender, **kwargs):
+    catalog_cache.bump_on_commit()
+
+
+@receiver(availability_changed)
+def invalidate_catalog_availability(sender, **kwargs):
+    # Availability is refreshed after commit, when the catalog version
+    # has already been bumped, so it is bumped once more
+    catalog_cache.bump()
+
+
+@receiver(pre_save, sender=RestaurantMenuItem)
+def remember_menu_item_product(sender, instance, **kwargs):
+    if instance.pk:
+        instance.previous_product_id = (
+            RestaurantMenuItem.objects
+            .filter(pk=instance.pk)
+            .values_list('product_id', flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def refresh_product_availability(sender, instance, **kwargs):
+    product_ids = {instance.product_id}
+    previous_product_id = getattr(instance, 'previous_product_id', None)
+    if previous_product_id:
+        product_ids.add(previous_product_id)
+    schedule_availability_refresh(product_ids)
+
+
+@receiver(availability_changed)
+def refresh_availability_index(sender, product_ids, **kwargs):
+    availability_index.refresh_products(product_ids)
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_availability_index(sender, **kwargs):
+    availability_index.invalidate()
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def refresh_restaurant_location(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: restaurant_locator.refresh_restaurants([instance.pk]))
+
+
+@receiver(coordinates_changed)
+def refresh_restaurant_locations(sender, addresses, **kwargs):
+    transaction.on_commit(
+        lambda: restaurant_locator.refresh_addresses(addresses))
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def invalidate_banners(sender, **kwargs):
+    banners_cache.bump_on_commit()
+
+
+@receiver(post_save, sender=Product)
+def generate_image_derivatives(sender, instance, **kwargs):
+    if instance.image and \
+            instance.image_derivatives.get('source') != instance.image.name:
+        schedule_derivatives(instance.pk)
@@ -0,0 +1,92 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+from .catalog import dump_banners, dump_catalog
+from .payloads import compress
+
+
+FILE_SUFFIXES = {
+    'identity': '',
+    'gzip': '.gz',
+    'br': '.br',
+}
+
+
+def get_snapshots_root():
+    return os.path.join(settings.STATIC_ROOT, 'catalog')
+
+
+def write_payload(directory, filename, payload):
+    if 'gzip' not in payload:
+        payload = compress(payload['identity'])
+    for encoding, suffix in FILE_SUFFIXES.items():
+        with open(os.path.join(directory, filename + suffix), 'wb') as file:
+            file.write(payload[encoding])
+
+
+def export_snapshot(keep=3):
+    """Write the products and banners payloads to a directory named after
+    their content.
+
+    The `current` symlink is switched to the new directory atomically, so
+    nginx never serves a half-written snapshot. Returns the directory of
+    the new snapshot, or None when the catalog has not changed.
+    """
+    if keep < 1:
+        raise ValueError('keep must be at least 1')
+
+    # The payloads are built here rather than taken from the API caches:
+    # with a per-process cache the changes made by the site are not seen
+    products = dump_catalog()
+    banners = dump_banners()
+    content_hash = hashlib.sha256()
+    for payload in (products, banners):
+        content_hash.update(payload['identity'])
+        content_hash.update(b'\0')
+    name = content_hash.hexdigest()[:16]
+
+    root = get_snapshots_root()
+    directory = os.path.join(root, name)
+    current_link = os.path.join(root, 'current')
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, '.lock'), 'w') as lock_file:
+        # Exports started at the same time run one after another
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.islink(current_link) \
+                and os.readlink(current_link) == name:
+            return None
+
+        temp_directory = tempfile.mkdtemp(dir=root, suffix='.tmp')
+        write_payload(temp_directory, 'products.json', products)
+        write_payload(temp_directory, 'banners.json', banners)
+        os.chmod(temp_directory, 0o755)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(temp_directory, directory)
+
+        temp_link = f'{current_link}.tmp'
+        if os.path.lexists(temp_link):
+            os.remove(temp_link)
+        os.symlink(name, temp_link)
+        os.replace(temp_link, current_link)
+
+        remove_old_snapshots(root, keep=keep, current=name)
+    return directory
+
+
+def remove_old_snapshots(root, keep, current):
+    snapshots = sorted(
+        (entry for entry in os.scandir(root)
+         if entry.is_dir(follow_symlinks=False)
+         and not entry.name.endswith('.tmp')
+         and entry.name != current),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    # The previous snapshots stay for clients that have just read `current`
+    for entry in snapshots[keep - 1:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,176 @@
+import functools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tickets (
+    id TEXT PRIMARY KEY,
+    idempotency_key TEXT UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    result TEXT,
+    queued_at REAL NOT NULL,
+    drained_at REAL,
+    claimed_by TEXT,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS tickets_status_queued_at
+    ON tickets (status, queued_at);
+CREATE INDEX IF NOT EXISTS tickets_drained_at
+    ON tickets (drained_at);
+'''
+
+CLAIM_COLUMNS = {
+    'claimed_by': 'TEXT',
+    'claimed_at': 'REAL',
+}
+
+
+class OrderSpool:
+    """Durable queue of accepted but not yet saved orders.
+
+    The spool lives in its own SQLite file, so accepting an order never
+    waits for the lock of the main database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL')
+            connection.executescript(SCHEMA)
+            self._add_claim_columns(connection)
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _add_claim_columns(connection):
+        # Spool files created before tickets were claimed lack the columns
+        columns = {
+            row['name']
+            for row in connection.execute('PRAGMA table_info(tickets)')
+        }
+        with connection:
+            for column, column_type in CLAIM_COLUMNS.items():
+                if column not in columns:
+                    connection.execute(
+                        f'ALTER TABLE tickets ADD COLUMN {column} {column_type}')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS tickets_claimed_by '
+                'ON tickets (claimed_by)')
+
+    def put(self, payload, idempotency_key=None):
+        ticket = uuid.uuid4().hex
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO tickets '
+                '(id, idempotency_key, payload, queued_at) '
+                'VALUES (?, ?, ?, ?)',
+                (ticket, idempotency_key, json.dumps(payload), time.time()),
+            )
+        if cursor.rowcount:
+            return ticket
+
+        row = self.connection.execute(
+            'SELECT id FROM tickets WHERE idempotency_key = ?',
+            (idempotency_key,),
+        ).fetchone()
+        return row['id']
+
+    def get(self, ticket):
+        row = self.connection.execute(
+            'SELECT id, status, result FROM tickets WHERE id = ?',
+            (ticket,),
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            'ticket': row['id'],
+            'status': row['status'],
+            **json.loads(row['result'] or '{}'),
+        }
+
+    def take(self, limit, claim_timeout=300):
+        """Claim up to `limit` queued tickets for one drain worker.
+
+        Returns the claim and the (ticket, payload) pairs. The tickets are
+        claimed with one UPDATE, so two workers never take the same ticket.
+        Tickets of a worker that has not completed them in `claim_timeout`
+        seconds are claimed again.
+        """
+        claim = uuid.uuid4().hex
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                'UPDATE tickets SET claimed_by = ?, claimed_at = ? '
+                'WHERE id IN ('
+                '    SELECT id FROM tickets WHERE status = ? '
+                '    AND (claimed_at IS NULL OR claimed_at < ?) '
+                '    ORDER BY queued_at LIMIT ?'
+                ')',
+                (claim, now, 'queued', now - claim_timeout, limit),
+            )
+        rows = self.connection.execute(
+            'SELECT id, payload FROM tickets WHERE claimed_by = ? '
+            'ORDER BY queued_at',
+            (claim,),
+        ).fetchall()
+        return claim, [(row['id'], json.loads(row['payload'])) for row in rows]
+
+    def complete(self, results):
+        drained_at = time.time()
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE tickets SET status = ?, result = ?, drained_at = ? '
+                'WHERE id = ?',
+                [
+                    (status, json.dumps(result), drained_at, ticket)
+                    for ticket, status, result in results
+                ],
+            )
+
+    def stats(self, window=60):
+        depth, = self.connection.execute(
+            'SELECT COUNT(*) FROM tickets WHERE status = ?',
+            ('queued',),
+        ).fetchone()
+        oldest_queued_at, = self.connection.execute(
+            'SELECT MIN(queued_at) FROM tickets WHERE status = ?',
+            ('queued',),
+        ).fetchone()
+        drained, = self.connection.execute(
+            'SELECT COUNT(*) FROM tickets WHERE drained_at >= ?',
+            (time.time() - window,),
+        ).fetchone()
+        return {
+            'depth': depth,
+            'oldest_age': time.time() - oldest_queued_at
+            if oldest_queued_at else 0,
+            'drain_rate': drained / window,
+        }
+
+    def purge(self, older_than):
+        with self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM tickets WHERE drained_at < ?',
+                (time.time() - older_than,),
+            )
+        return cursor.rowcount
+
+
+@functools.cache
+def get_order_spool():
+    return OrderSpool(settings.ORDER_SPOOL_PATH)
@@ -0,0 +1,827 @@
+import datetime
+import gzip
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import brotli
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, SimpleTestCase, TestCase
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from foodcartapp.availability import AvailabilityIndex, availability_cache
+from foodcartapp.availability import availability_index
+from foodcartapp.caching import banners_cache, catalog_cache
+from foodcartapp.checks import check_shared_cache
+from foodcartapp.management.commands.drain_order_spool import drain_batch
+from foodcartapp.models import Banner, IdempotencyKey, Order, OrderItem
+from foodcartapp.models import Product, Restaurant, RestaurantMenuItem
+from foodcartapp.payloads import choose_encoding
+from foodcartapp.snapshots import export_snapshot
+from foodcartapp.spool import OrderSpool
+from foodcartapp.thumbnails import make_derivatives
+from foodcartapp.views import create_order_response, parse_products_query
+
+
+class ProductAvailabilityTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = Restaurant.objects.create(name='Ресторан')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            # Without an image, no derivatives are made in the background
+            product = Product.objects.create(name='Бургер', price=100)
+            menu_item = RestaurantMenuItem.objects.create(
+                restaurant=self.restaurant, product=product)
+        return product, menu_item
+
+    def test_follows_menu_availability(self):
+        product, menu_item = self.create_product()
+        self.assertTrue(Product.objects.available().filter(
+            pk=product.pk).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item.availability = False
+            menu_item.save()
+
+        self.assertFalse(Product.objects.available().exists())
+
+    def test_saving_loaded_product_keeps_availability(self):
+        product, menu_item = self.create_product()
+        product = Product.objects.get(pk=product.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(pk=menu_item.pk) \
+                .update(availability=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = 'Чизбургер'
+            product.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.name, 'Чизбургер')
+        self.assertFalse(product.is_available)
+
+
+class AvailabilityIndexTest(SimpleTestCase):
+    def make_index(self, restaurant_ids, menu_items):
+        index = AvailabilityIndex()
+        index.load(restaurant_ids, menu_items,
+                   availability_cache.get_version())
+        return index
+
+    def assert_same_index(self, index, other_index, restaurant_ids,
+                          product_ids):
+        for restaurant_id in restaurant_ids:
+            self.assertEqual(index.products_for_restaurant(restaurant_id),
+                             other_index.products_for_restaurant(
+                                 restaurant_id))
+        for product_id in product_ids:
+            self.assertEqual(index.restaurants_for([product_id]),
+                             other_index.restaurants_for([product_id]))
+
+    def test_finds_restaurants_with_all_products(self):
+        index = self.make_index([1, 2, 3], [(1, 10), (1, 20), (2, 10),
+                                            (3, 20), (3, 10)])
+        with index.pinned():
+            self.assertEqual(index.restaurants_for([10, 20]), {1, 3})
+            self.assertEqual(index.restaurants_for([10]), {1, 2, 3})
+            self.assertEqual(index.restaurants_for([30]), set())
+            self.assertEqual(index.products_for_restaurant(2), [10])
+            self.assertIsNone(index.products_for_restaurant(4))
+
+    def test_updates_products_like_full_rebuild(self):
+        random_generator = random.Random(1)
+        restaurant_ids = list(range(1, 41))
+        product_ids = list(range(1, 61))
+        menu_items = {
+            (restaurant_id, product_id)
+            for restaurant_id in restaurant_ids
+            for product_id in product_ids
+            if random_generator.random() < 0.4
+        }
+        index = self.make_index(restaurant_ids, menu_items)
+
+        changed_ids = set(random_generator.sample(product_ids, 10)) | {70}
+        # A new restaurant and a new product show up with the change
+        restaurant_ids.append(50)
+        menu_items = {
+            (restaurant_id, product_id)
+            for restaurant_id, product_id in menu_items
+            if product_id not in changed_ids
+        } | {
+            (restaurant_id, product_id)
+            for restaurant_id in restaurant_ids
+            for product_id in changed_ids
+            if random_generator.random() < 0.4
+        }
+        index.update_products(changed_ids, [
+            (restaurant_id, product_id)
+            for restaurant_id, product_id in menu_items
+            if product_id in changed_ids
+        ])
+
+        with index.pinned():
+            self.assert_same_index(
+                index, self.make_index(restaurant_ids, menu_items),
+                restaurant_ids, product_ids + [70])
+
+
+class ExportSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        self.enterContext(override_settings(STATIC_ROOT=static_root.name))
+        self.root = os.path.join(static_root.name, 'catalog')
+
+    def add_banner(self):
+        Banner.objects.create(title=f'Баннер {Banner.objects.count()}',
+                              image='banner.jpg')
+
+    def list_snapshots(self):
+        return sorted(entry.name for entry in os.scandir(self.root)
+                      if entry.is_dir(follow_symlinks=False))
+
+    def test_skips_unchanged_catalog(self):
+        directory = export_snapshot()
+
+        self.assertTrue(os.path.exists(
+            os.path.join(self.root, 'current', 'products.json.br')))
+        self.assertEqual(os.path.realpath(os.path.join(self.root, 'current')),
+                         os.path.realpath(directory))
+        self.assertIsNone(export_snapshot())
+
+    def test_keeps_last_snapshots(self):
+        directories = []
+        for _ in range(4):
+            self.add_banner()
+            directories.append(os.path.basename(export_snapshot(keep=2)))
+
+        self.assertEqual(self.list_snapshots(), sorted(directories[-2:]))
+        self.assertEqual(os.readlink(os.path.join(self.root, 'current')),
+                         directories[-1])
+
+    def test_rejects_keeping_no_snapshots(self):
+        export_snapshot()
+        self.add_banner()
+
+        with self.assertRaises(ValueError):
+            export_snapshot(keep=0)
+        self.assertEqual(len(self.list_snapshots()), 1)
+
+
+class BannersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_shows_banners_within_their_time_window(self):
+        now = timezone.now()
+        hour = datetime.timedelta(hours=1)
+        Banner.objects.all().delete()
+        Banner.objects.create(title='Всегда', image='always.jpg')
+        Banner.objects.create(title='Сейчас', image='now.jpg',
+                              active_from=now - hour,
+                              active_until=now + hour)
+        Banner.objects.create(title='Скоро', image='soon.jpg',
+                              active_from=now + hour)
+        Banner.objects.create(title='Прошёл', image='past.jpg',
+                              active_until=now - hour)
+
+        response = self.client.get('/api/banners/')
+
+        self.assertEqual([banner['title'] for banner in response.json()],
+                         ['Всегда', 'Сейчас'])
+
+    def test_reads_banners_from_cache_once_per_request(self):
+        hits, misses = banners_cache.hits, banners_cache.misses
+
+        first = self.client.get('/api/banners/')
+        second = self.client.get('/api/banners/')
+
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(banners_cache.misses - misses, 1)
+        self.assertEqual(banners_cache.hits - hits, 1)
+
+    def test_loads_images_of_default_banners(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+
+        with override_settings(MEDIA_ROOT=media_root.name):
+            call_command('load_banner_images', stdout=io.StringIO())
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(media_root.name, 'banners'))),
+            ['burger.jpg', 'food.jpg', 'tasty.jpg'])
+
+
+def make_order_payload(products, **fields):
+    return {
+        'firstname': 'Иван',
+        'lastname': 'Иванов',
+        'phonenumber': '+79001234567',
+        'address': 'Москва, Тверская 1',
+        'products': [{'product': product.id, 'quantity': 1}
+                     for product in products],
+        **fields,
+    }
+
+
+class OrderSpoolTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Бургер',
+                                             price=100,
+                                             image='burger.jpg')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spool = OrderSpool(os.path.join(directory.name, 'spool.sqlite3'))
+        self.addCleanup(lambda: self.spool.connection.close())
+
+    def test_accepts_order_and_reports_ticket_status(self):
+        with mock.patch('foodcartapp.views.get_order_spool',
+                        return_value=self.spool):
+            response = self.client.post(
+                '/api/order/', make_order_payload([self.product]),
+                content_type='application/json',
+                headers={'Prefer': 'respond-async'})
+            ticket = response.json()['ticket']
+            queued = self.client.get(f'/api/order/tickets/{ticket}/').json()
+
+            drain_batch(self.spool, batch_size=10)
+            done = self.client.get(f'/api/order/tickets/{ticket}/').json()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(queued['status'], 'queued')
+        self.assertEqual(done['status'], 'done')
+        self.assertEqual(done['order']['id'], Order.objects.get().id)
+
+    def test_reports_invalid_orders(self):
+        ticket = self.spool.put(make_order_payload([], firstname=''))
+
+        drain_batch(self.spool, batch_size=10)
+
+        self.assertEqual(self.spool.get(ticket)['status'], 'failed')
+        self.assertFalse(Order.objects.exists())
+
+    def test_two_workers_never_take_same_ticket(self):
+        tickets = {self.spool.put(make_order_payload([self.product]))
+                   for _ in range(5)}
+        other_spool = OrderSpool(self.spool.path)
+        self.addCleanup(lambda: other_spool.connection.close())
+
+        _, first_tickets = self.spool.take(3)
+        _, second_tickets = other_spool.take(3)
+
+        first_ids = {ticket for ticket, _ in first_tickets}
+        second_ids = {ticket for ticket, _ in second_tickets}
+        self.assertEqual(len(first_ids), 3)
+        self.assertFalse(first_ids & second_ids)
+        self.assertEqual(first_ids | second_ids, tickets)
+
+    def test_does_not_save_reclaimed_ticket_twice(self):
+        ticket = self.spool.put(make_order_payload([self.product]))
+        # The first worker has saved the order, but not marked the ticket
+        IdempotencyKey.objects.create(key=f'spool:{ticket}',
+                                      fingerprint='other worker',
+                                      response_status=200,
+                                      response_body={'order': {'id': 1}})
+
+        drain_batch(self.spool, batch_size=10)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.spool.get(ticket)['status'], 'done')
+
+
+class SpoolWhileDatabaseIsLockedTest(TransactionTestCase):
+    def test_accepts_order_while_database_is_locked(self):
+        product = Product.objects.create(name='Бургер', price=100)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        spool = OrderSpool(os.path.join(directory.name, 'spool.sqlite3'))
+        self.addCleanup(lambda: spool.connection.close())
+        # Another writer holds the write lock of the order database
+        other_connection = sqlite3.connect(
+            connection.settings_dict['NAME'], isolation_level=None)
+        self.addCleanup(other_connection.close)
+        other_connection.execute('BEGIN IMMEDIATE')
+        self.addCleanup(other_connection.execute, 'ROLLBACK')
+
+        with mock.patch('foodcartapp.views.get_order_spool',
+                        return_value=spool):
+            response = self.client.post(
+                '/api/order/', make_order_payload([product]),
+                content_type='application/json',
+                headers={'Prefer': 'respond-async'})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(spool.get(response.json()['ticket'])['status'],
+                         'queued')
+
+
+class IdempotencyKeyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Бургер',
+                                             price=100,
+                                             image='burger.jpg')
+
+    def post_order(self, payload, key):
+        return self.client.post('/api/order/', payload,
+                                content_type='application/json',
+                                headers={'Idempotency-Key': key})
+
+    def test_replays_response_for_same_key(self):
+        payload = make_order_payload([self.product])
+
+        first = self.post_order(payload, 'key-1')
+        second = self.post_order(payload, 'key-1')
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_rejects_same_key_with_other_request(self):
+        self.post_order(make_order_payload([self.product]), 'key-1')
+
+        response = self.post_order(
+            make_order_payload([self.product], firstname='Пётр'), 'key-1')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class ConcurrentIdempotencyKeyTest(TransactionTestCase):
+    def test_waits_for_request_with_same_key(self):
+        product = Product.objects.create(name='Бургер', price=100)
+        payload = make_order_payload([product])
+        responses = []
+
+        def slow_create_order_response(data):
+            # Keep the first transaction open while the second one starts
+            time.sleep(0.2)
+            return create_order_response(data)
+
+        def post_order():
+            try:
+                responses.append(Client().post(
+                    '/api/order/', payload,
+                    content_type='application/json',
+                    headers={'Idempotency-Key': 'key-1'}))
+            finally:
+                connection.close()
+
+        with mock.patch('foodcartapp.views.create_order_response',
+                        side_effect=slow_create_order_response), \
+                mock.patch('foodcartapp.serializers.schedule_geocoding'):
+            threads = [threading.Thread(target=post_order)
+                       for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual([response.status_code for response in responses],
+                         [200, 200])
+        self.assertEqual(
+            sorted(response.headers.get('Idempotent-Replayed', '')
+                   for response in responses),
+            ['', 'true'])
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class CatalogApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = Restaurant.objects.create(name='Ресторан')
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}',
+                                   price=100 + number,
+                                   image='burger.jpg',
+                                   is_available=True)
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_caches_products_payload(self):
+        first = self.client.get('/api/products/')
+        second = self.client.get('/api/products/')
+
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(len(first.json()), 3)
+
+    def test_rebuilds_payload_after_catalog_change(self):
+        self.client.get('/api/products/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.create(restaurant=self.restaurant,
+                                              product=self.products[0],
+                                              availability=False)
+        response = self.client.get('/api/products/')
+
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()), 2)
+
+    def test_sends_compressed_payload(self):
+        plain = self.client.get('/api/products/')
+        brotli_response = self.client.get(
+            '/api/products/', headers={'Accept-Encoding': 'gzip, br'})
+        gzip_response = self.client.get(
+            '/api/products/', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(brotli_response.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(brotli_response.content),
+                         plain.content)
+        self.assertEqual(gzip_response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzip_response.content),
+                         plain.content)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+    def test_returns_requested_fields_by_pages(self):
+        response = self.client.get('/api/products/', {
+            'fields': 'name,id,',
+            'limit': 2,
+        })
+        page = response.json()
+        next_page = self.client.get('/api/products/', {
+            'fields': 'name,id,',
+            'limit': 2,
+            'cursor': page['next_cursor'],
+        }).json()
+
+        self.assertEqual(page['results'], [
+            {'id': product.id, 'name': product.name}
+            for product in self.products[:2]
+        ])
+        self.assertEqual(next_page['results'], [
+            {'id': self.products[2].id, 'name': self.products[2].name}])
+        self.assertIsNone(next_page['next_cursor'])
+
+    def test_answers_not_modified(self):
+        etag = self.client.get('/api/products/').headers['ETag']
+
+        response = self.client.get('/api/products/',
+                                   headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_answers_not_modified_since(self):
+        last_modified = self.client.get('/api/products/') \
+            .headers['Last-Modified']
+
+        response = self.client.get(
+            '/api/products/', headers={'If-Modified-Since': last_modified})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['Last-Modified'], last_modified)
+
+    def test_answers_not_modified_without_reading_payload(self):
+        etag = self.client.get('/api/products/').headers['ETag']
+        # Another process has not read the payload yet
+        catalog_cache._local_values.clear()
+
+        with mock.patch.object(catalog_cache, 'get_or_build') as get_or_build:
+            response = self.client.get('/api/products/',
+                                       headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        get_or_build.assert_not_called()
+
+    def test_etag_follows_content(self):
+        etag = self.client.get('/api/products/').headers['ETag']
+        # Another process has its own cache and catalog version
+        cache.clear()
+        self.assertEqual(
+            self.client.get('/api/products/').headers['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.products[0].pk) \
+                .update(name='Чизбургер')
+            Product.objects.get(pk=self.products[0].pk).save()
+        response = self.client.get('/api/products/',
+                                   headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.json()[0]['name'], 'Чизбургер')
+
+
+class RestaurantMenusApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurants = [
+            Restaurant.objects.create(name=f'Ресторан {number}')
+            for number in range(2)
+        ]
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}', price=100)
+            for number in range(3)
+        ]
+        for product in cls.products[:2]:
+            RestaurantMenuItem.objects.create(restaurant=cls.restaurants[0],
+                                              product=product)
+        RestaurantMenuItem.objects.create(restaurant=cls.restaurants[1],
+                                          product=cls.products[2],
+                                          availability=False)
+
+    def setUp(self):
+        # The availability index outlives the rolled back test transactions
+        cache.clear()
+        availability_index.restaurant_ids()
+
+    def test_returns_menu_of_restaurant(self):
+        restaurant = self.restaurants[0]
+
+        response = self.client.get(f'/api/restaurants/{restaurant.id}/menu/')
+
+        self.assertEqual(response.json(), {
+            'id': restaurant.id,
+            'products': [product.id for product in self.products[:2]],
+        })
+
+    def test_returns_not_found_for_unknown_restaurant(self):
+        response = self.client.get('/api/restaurants/1000/menu/')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_returns_menus_of_all_restaurants(self):
+        response = self.client.get('/api/restaurants/menus/')
+
+        self.assertEqual(response.json(), [
+            {'id': self.restaurants[0].id,
+             'products': [product.id for product in self.products[:2]]},
+            {'id': self.restaurants[1].id, 'products': []},
+        ])
+
+
+@override_settings(PRODUCT_IMAGE_WIDTHS=[20, 200])
+class ImageDerivativesTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    def save_image(self, name, image, **options):
+        buffer = io.BytesIO()
+        image.save(buffer, **options)
+        storage = Product._meta.get_field('image').storage
+        name = storage.save(name, ContentFile(buffer.getvalue()))
+        return Product(image=name).image
+
+    def open_derivative(self, derivative):
+        storage = Product._meta.get_field('image').storage
+        return Image.open(storage.path(derivative['name']))
+
+    def test_makes_smaller_copies_only(self):
+        image_file = self.save_image('burger.jpg', Image.new('RGB', (100, 50)),
+                                     format='JPEG')
+
+        derivatives = make_derivatives(image_file)
+
+        self.assertEqual(derivatives['source'], 'burger.jpg')
+        self.assertEqual(
+            [(derivative['width'], derivative['type'])
+             for derivative in derivatives['srcset']],
+            [(20, 'image/webp'), (20, 'image/jpeg')])
+        with self.open_derivative(derivatives['srcset'][1]) as image:
+            self.assertEqual(image.size, (20, 10))
+
+    def test_keeps_transparency_in_png(self):
+        image_file = self.save_image(
+            'logo.png', Image.new('RGBA', (100, 100)), format='PNG')
+
+        derivatives = make_derivatives(image_file)
+
+        self.assertEqual(derivatives['srcset'][1]['type'], 'image/png')
+
+    def test_applies_exif_orientation(self):
+        exif = Image.Exif()
+        # Rotated 90° clockwise when shown
+        exif[0x0112] = 6
+        image_file = self.save_image('photo.jpg', Image.new('RGB', (100, 50)),
+                                     format='JPEG', exif=exif)
+
+        derivatives = make_derivatives(image_file)
+
+        for derivative in derivatives['srcset']:
+            with self.open_derivative(derivative) as image:
+                self.assertEqual(image.size, (20, 40))
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+    def check(self, backend, debug=False):
+        with override_settings(DEBUG=debug,
+                               CACHES={'default': {'BACKEND': backend}}):
+            return [error.id for error in check_shared_cache(None)]
+
+    def test_rejects_process_local_cache_in_production(self):
+        self.assertEqual(
+            self.check('django.core.cache.backends.locmem.LocMemCache'),
+            ['foodcartapp.E001'])
+
+    def test_accepts_process_local_cache_in_debug(self):
+        self.assertEqual(
+            self.check('django.core.cache.backends.locmem.LocMemCache',
+                       debug=True),
+            [])
+
+    def test_accepts_shared_cache(self):
+        self.assertEqual(
+            self.check('django.core.cache.backends.filebased.FileBasedCache'),
+            [])
+
+
+class ChooseEncodingTest(SimpleTestCase):
+    def test_prefers_brotli(self):
+        self.assertEqual(choose_encoding('gzip, deflate, br', ['br', 'gzip']),
+                         'br')
+
+    def test_respects_quality(self):
+        self.assertEqual(choose_encoding('br;q=0, gzip;q=0.5',
+                                         ['br', 'gzip']),
+                         'gzip')
+        self.assertEqual(choose_encoding('*;q=0', ['br', 'gzip']),
+                         'identity')
+        self.assertEqual(choose_encoding('br;q=oops', ['br', 'gzip']),
+                         'identity')
+
+    def test_sends_only_available_encodings(self):
+        self.assertEqual(choose_encoding('br, gzip', []), 'identity')
+        self.assertEqual(choose_encoding('*', ['gzip']), 'gzip')
+
+
+@override_settings(PRODUCTS_PAGE_SIZE=10, PRODUCTS_PAGE_MAX_SIZE=50)
+class ParseProductsQueryTest(SimpleTestCase):
+    def assert_rejected(self, params, message):
+        with self.assertRaisesMessage(ValueError, message):
+            parse_products_query(params)
+
+    def test_parses_fields(self):
+        self.assertEqual(parse_products_query({'fields': 'price, id,'}),
+                         {'fields': ('id', 'price')})
+
+    def test_rejects_empty_and_unknown_fields(self):
+        self.assert_rejected({'fields': ''},
+                             'fields must name at least one field')
+        self.assert_rejected({'fields': ','},
+                             'fields must name at least one field')
+        self.assert_rejected({'fields': 'id,weight,color'},
+                             'unknown fields: color, weight')
+
+    def test_parses_page(self):
+        self.assertEqual(parse_products_query({'limit': '5'}),
+                         {'after_id': 0, 'limit': 5})
+        self.assertEqual(parse_products_query({'cursor': '7'}),
+                         {'after_id': 7, 'limit': 10})
+
+    def test_rejects_bad_page(self):
+        self.assert_rejected({'limit': '0'}, 'limit must be from 1 to 50')
+        self.assert_rejected({'limit': '51'}, 'limit must be from 1 to 50')
+        self.assert_rejected({'cursor': 'abc'}, 'cursor must be an integer')
+        self.assert_rejected({'special': 'maybe'},
+                             'special must be true or false')
+
+
+class RegisterOrderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}',
+                                   price=100 + number,
+                                   image='burger.jpg')
+            for number in range(10)
+        ]
+
+    def post_order(self, payload):
+        return self.client.post('/api/order/', payload,
+                                content_type='application/json')
+
+    def count_queries(self, products):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_order(make_order_payload(products))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_saves_items_with_product_prices(self):
+        payload = make_order_payload(self.products[:2])
+        payload['products'].append({'product': self.products[0].id,
+                                    'quantity': 2})
+
+        response = self.post_order(payload)
+
+        items = OrderItem.objects.filter(order_id=response.json()['id'])
+        self.assertEqual(
+            sorted(items.values_list('product_id', 'quantity', 'price_fixed')),
+            [(self.products[0].id, 3, 100), (self.products[1].id, 1, 101)])
+
+    def test_query_count_does_not_grow_with_products(self):
+        self.assertEqual(self.count_queries(self.products),
+                         self.count_queries(self.products[:1]))
+
+    def test_rejects_unknown_products(self):
+        payload = make_order_payload(self.products[:1])
+        payload['products'].append({'product': 1000, 'quantity': 1})
+
+        response = self.post_order(payload)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['products'], ['invalid id 1000'])
+        self.assertFalse(Order.objects.exists())
+
+
+class RegisterOrdersBatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Бургер',
+                                             price=100,
+                                             image='burger.jpg')
+
+    def post_orders(self, payloads):
+        return self.client.post('/api/orders/batch/', payloads,
+                                content_type='application/json')
+
+    def test_saves_valid_orders_and_reports_invalid_ones(self):
+        response = self.post_orders([
+            make_order_payload([self.product], firstname='Иван'),
+            make_order_payload([], firstname='Пётр'),
+            make_order_payload([self.product], firstname='Анна'),
+        ])
+
+        results = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(results[0]['order']['firstname'], 'Иван')
+        self.assertIn('products', results[1]['errors'])
+        self.assertEqual(results[2]['order']['firstname'], 'Анна')
+        self.assertEqual(
+            sorted(Order.objects.values_list('firstname', flat=True)),
+            ['Анна', 'Иван'])
+        self.assertEqual(OrderItem.objects.count(), 2)
+
+    @override_settings(ORDERS_BATCH_MAX_SIZE=2)
+    def test_rejects_too_many_orders(self):
+        response = self.post_orders(
+            [make_order_payload([self.product])] * 3)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_rejects_empty_batch(self):
+        self.assertEqual(self.post_orders([]).status_code, 400)
+        self.assertEqual(self.post_orders({}).status_code, 400)
+
+
+class OrderTotalPriceTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}',
+                                   price=100 + number,
+                                   image='burger.jpg')
+            for number in range(2)
+        ]
+
+    def test_stores_total_price_at_order_time(self):
+        payload = make_order_payload(self.products)
+        payload['products'][1]['quantity'] = 3
+        response = self.client.post('/api/order/', payload,
+                                    content_type='application/json')
+
+        Product.objects.update(price=500)
+
+        order = Order.objects.price().get(id=response.json()['id'])
+        self.assertEqual(order.total_price, 100 + 101 * 3)
+        self.assertEqual(order.price, order.total_price)
+
+    def test_backfills_drifted_totals(self):
+        response = self.client.post(
+            '/api/order/', make_order_payload(self.products),
+            content_type='application/json')
+        Order.objects.update(total_price=0)
+
+        call_command('backfill_order_totals', stdout=io.StringIO())
+
+        order = Order.objects.get(id=response.json()['id'])
+        self.assertEqual(order.total_price, 201)
@@ -0,0 +1,103 @@
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .caching import catalog_cache
+from .models import Product
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 6}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True,
+                                   'progressive': True}),
+    'png': ('PNG', 'image/png', {'optimize': True}),
+}
+
+executor = ThreadPoolExecutor(max_workers=1,
+                              thread_name_prefix='image-derivatives')
+
+
+def make_derivatives(image_file):
+    """Save resized copies of the image next to it in WebP and JPEG/PNG.
+
+    Names hold a hash of the original content, so the derivatives of an
+    unchanged image are not written again.
+    """
+    storage = image_file.storage
+    with image_file.open('rb'):
+        content = image_file.read()
+    content_hash = hashlib.sha256(content).hexdigest()[:12]
+    directory, filename = os.path.split(image_file.name)
+    stem = os.path.splitext(filename)[0]
+
+    with Image.open(io.BytesIO(content)) as image:
+        image.load()
+    # Phone photos are stored sideways with the rotation in EXIF
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') \
+        or (image.mode == 'P' and 'transparency' in image.info)
+    fallback_extension = 'png' if has_alpha else 'jpg'
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    srcset = []
+    for width in settings.PRODUCT_IMAGE_WIDTHS:
+        if width >= image.width:
+            continue
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+
+        for extension in ('webp', fallback_extension):
+            image_format, mime_type, options = FORMATS[extension]
+            name = os.path.join(
+                directory, f'{stem}.{content_hash}.{width}w.{extension}')
+            if not storage.exists(name):
+                buffer = io.BytesIO()
+                resized.save(buffer, format=image_format, **options)
+                name = storage.save(name, ContentFile(buffer.getvalue()))
+            srcset.append({
+                'name': name,
+                'width': width,
+                'type': mime_type,
+            })
+
+    return {'source': image_file.name, 'srcset': srcset}
+
+
+def generate_product_derivatives(product_id):
+    product = Product.objects.filter(pk=product_id).first()
+    if not product or not product.image:
+        return False
+
+    derivatives = make_derivatives(product.image)
+    updated = (
+        Product.objects
+        .filter(pk=product_id, image=product.image.name)
+        .update(image_derivatives=derivatives)
+    )
+    if updated:
+        catalog_cache.bump()
+    return bool(updated)
+
+
+def _generate_in_background(product_id):
+    try:
+        generate_product_derivatives(product_id)
+    except Exception:
+        logger.exception('Image derivatives for product %s failed',
+                         product_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_derivatives(product_id):
+    transaction.on_commit(
+        lambda: executor.submit(_generate_in_background, product_id))
@@ -1,85 +1,295 @@
-from django.http import JsonResponse, Http404
-from django.templatetags.static import static
+import hashlib
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, urlencode
 from django.db import transaction
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from .models import Product
-from .serializers import OrderSerializer
+from .availability import availability_cache, availability_index
+from .caching import banners_cache, catalog_cache
+from .catalog import PRODUCT_FIELDS, dump_banners, dump_catalog
+from .catalog import dump_products, expire_banners, get_products
+from .models import IdempotencyKey
+from .payloads import ENCODINGS, build_payload, choose_encoding
+from .serializers import OrderSerializer, save_orders
+from .spool import get_order_spool
+
+
+def get_payload_validators(versioned_cache, key, version):
+    """ETag and build time of the cached payload. They are stored apart
+    from the payload, so a conditional request is answered without reading
+    or building it."""
+    payload = versioned_cache.get_local(key, version)
+    if payload is not None:
+        return payload['etag'], payload['built_at']
+    return versioned_cache.get(f'{key}:validators', version)
+
+
+def get_cached_json_response(request, versioned_cache, key, build,
+                             keep_local=True, cached=None):
+    """JSON response with the payload from the versioned cache.
+
+    `cached` is the (payload, hit) pair when the caller has already got
+    the payload from the cache.
+    """
+    available_encodings = ENCODINGS if settings.API_PRECOMPRESS else []
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''),
+                               available_encodings)
+    version = versioned_cache.get_version() if cached is None else None
+
+    def get_payload():
+        payload, hit = versioned_cache.get_or_build(key, build,
+                                                    version=version,
+                                                    keep_local=keep_local)
+        if not hit:
+            versioned_cache.set(f'{key}:validators',
+                                (payload['etag'], payload['built_at']),
+                                version)
+        return payload, hit
+
+    payload, hit = cached or (None, False)
+    validators = None
+    if payload is None and ('If-None-Match' in request.headers
+                            or 'If-Modified-Since' in request.headers):
+        validators = get_payload_validators(versioned_cache, key, version)
+    if payload is None and validators is None:
+        payload, hit = get_payload()
+    if validators is None:
+        validators = payload['etag'], payload['built_at']
+    content_hash, built_at = validators
+    # The ETag comes from the content, so it is the same in every process
+    # whatever cache versions they have
+    etag = f'"{content_hash}-{encoding}"'
+    last_modified = int(built_at)
+
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        if payload is None:
+            payload, hit = get_payload()
+        response = HttpResponse(payload[encoding],
+                                content_type='application/json',
+                                headers={'X-Cache': 'HIT' if hit else 'MISS'})
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
 
 
 def banners_list_api(request):
-    # FIXME move data to db?
-    return JsonResponse([
-        {
-            'title': 'Burger',
-            'src': static('burger.jpg'),
-            'text': 'Tasty Burger at your door step',
-        },
-        {
-            'title': 'Spices',
-            'src': static('food.jpg'),
-            'text': 'All Cuisines',
-        },
-        {
-            'title': 'New York',
-            'src': static('tasty.jpg'),
-            'text': 'Food is incomplete without a tasty dessert',
-        }
-    ], safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
+    return get_cached_json_response(request, banners_cache, 'banners',
+                                    dump_banners, cached=expire_banners())
+
+
+def parse_products_query(params):
+    query = {}
+
+    fields = params.get('fields')
+    if fields is not None:
+        requested_fields = {
+            field.strip() for field in fields.split(',') if field.strip()}
+        if not requested_fields:
+            raise ValueError('fields must name at least one field')
+        unknown_fields = requested_fields - set(PRODUCT_FIELDS)
+        if unknown_fields:
+            raise ValueError(
+                f'unknown fields: {", ".join(sorted(unknown_fields))}')
+        query['fields'] = tuple(
+            field for field in PRODUCT_FIELDS if field in requested_fields)
+
+    if 'category' in params:
+        query['category_id'] = parse_int(params['category'], 'category')
+
+    special = params.get('special')
+    if special is not None:
+        if special not in ('true', 'false', '1', '0'):
+            raise ValueError('special must be true or false')
+        query['special'] = special in ('true', '1')
+
+    if 'cursor' in params or 'limit' in params:
+        query['after_id'] = parse_int(params.get('cursor', '0'), 'cursor')
+        query['limit'] = parse_int(
+            params.get('limit', str(settings.PRODUCTS_PAGE_SIZE)), 'limit')
+        if not 0 < query['limit'] <= settings.PRODUCTS_PAGE_MAX_SIZE:
+            raise ValueError(
+                f'limit must be from 1 to {settings.PRODUCTS_PAGE_MAX_SIZE}')
+
+    return query
+
+
+def parse_int(value, name):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def dump_products_query(query):
+    fields = query.get('fields', PRODUCT_FIELDS)
+    limit = query.get('limit')
+    products = get_products(fields=fields,
+                            category_id=query.get('category_id'),
+                            special=query.get('special'),
+                            after_id=query.get('after_id'))
+    if limit is None:
+        return build_payload(dump_products(products, fields))
+
+    products = list(products[:limit + 1])
+    next_cursor = str(products[limit - 1]['id']) \
+        if len(products) > limit else None
+    return build_payload({
+        'results': dump_products(products[:limit], fields),
+        'next_cursor': next_cursor,
     })
 
 
 def product_list_api(request):
-    products = Product.objects.select_related('category').available()
-
-    dumped_products = []
-    for product in products:
-        dumped_product = {
-            'id': product.id,
-            'name': product.name,
-            'price': product.price,
-            'special_status': product.special_status,
-            'description': product.description,
-            'category': {
-                'id': product.category.id,
-                'name': product.category.name,
-            } if product.category else None,
-            'image': product.image.url,
-            'restaurant': {
-                'id': product.id,
-                'name': product.name,
-            }
-        }
-        dumped_products.append(dumped_product)
-    return JsonResponse(dumped_products, safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    if not request.GET:
+        return get_cached_json_response(request, catalog_cache, 'products',
+                                        dump_catalog)
 
+    try:
+        query = parse_products_query(request.GET)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
 
-@transaction.atomic
-@api_view(['POST'])
-def register_order(request):
-    err_content = None
-    product_id = None
+    query_hash = hashlib.md5(urlencode(sorted(query.items())).encode())
+    key = f'products-{query_hash.hexdigest()}'
+    return get_cached_json_response(request, catalog_cache, key,
+                                    lambda: dump_products_query(query),
+                                    keep_local=False)
 
-    data = request.data
-    serializer = OrderSerializer(data=data)
-    serializer.is_valid(raise_exception=True)
 
-    try:
-        new_order = serializer.save()
+def dump_restaurant_menu(restaurant_id):
+    return {
+        'id': restaurant_id,
+        'products': availability_index.products_for_restaurant(restaurant_id),
+    }
+
 
-    except Http404:
-        err_content = {
-            'error': f'products: invalid id {product_id}'} \
-            if not err_content else err_content
-        return Response(err_content, status=status.HTTP_404_NOT_FOUND)
+def restaurant_menu_api(request, restaurant_id):
+    if availability_index.products_for_restaurant(restaurant_id) is None:
+        return JsonResponse({'error': f'restaurant {restaurant_id} not found'},
+                            status=404)
+
+    return get_cached_json_response(
+        request, availability_cache, f'menu-{restaurant_id}',
+        lambda: build_payload(dump_restaurant_menu(restaurant_id))
+    )
+
+
+def restaurant_menus_api(request):
+    return get_cached_json_response(
+        request, availability_cache, 'menus',
+        lambda: build_payload([
+            dump_restaurant_menu(restaurant_id)
+            for restaurant_id in availability_index.restaurant_ids()
+        ])
+    )
+
+
+def create_order_response(data):
+    serializer = OrderSerializer(data=data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    new_order = serializer.save()
 
     new_order_serialized = OrderSerializer(new_order)
 
     return Response(new_order_serialized.data)
+
+
+def get_request_fingerprint(data):
+    dumped_data = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(dumped_data.encode()).hexdigest()
+
+
+def spool_order(request, key):
+    serializer = OrderSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    ticket = get_order_spool().put(request.data, idempotency_key=key)
+    ticket_url = reverse('foodcartapp:order_ticket', args=(ticket,))
+
+    return Response({'ticket': ticket},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': request.build_absolute_uri(ticket_url)})
+
+
+@api_view(['POST'])
+def register_order(request):
+    key = request.headers.get('Idempotency-Key')
+    # The spool accepts orders while the order database is busy, so no
+    # transaction is opened on the way there
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return spool_order(request, key)
+    return register_order_now(request, key)
+
+
+@transaction.atomic
+def register_order_now(request, key):
+    if not key:
+        return create_order_response(request.data)
+    if len(key) > 255:
+        return Response({'error': 'Idempotency-Key is too long'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    fingerprint = get_request_fingerprint(request.data)
+    IdempotencyKey.objects.expired().filter(key=key).delete()
+    # A concurrent request with the same key blocks on the unique index
+    # until the first one commits, and then replays its response.
+    idempotency_key, created = IdempotencyKey.objects.get_or_create(
+        key=key,
+        defaults={'fingerprint': fingerprint},
+    )
+
+    if not created:
+        if idempotency_key.fingerprint != fingerprint:
+            return Response(
+                {'error': 'Idempotency-Key was used with another request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(idempotency_key.response_body,
+                        status=idempotency_key.response_status,
+                        headers={'Idempotent-Replayed': 'true'})
+
+    response = create_order_response(request.data)
+    idempotency_key.response_status = response.status_code
+    idempotency_key.response_body = response.data
+    idempotency_key.save(update_fields=['response_status', 'response_body'])
+
+    return response
+
+
+@transaction.atomic
+@api_view(['POST'])
+def register_orders_batch(request):
+    payloads = request.data
+    if not isinstance(payloads, list) or not payloads:
+        return Response({'error': 'expected a non-empty list of orders'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if len(payloads) > settings.ORDERS_BATCH_MAX_SIZE:
+        return Response(
+            {'error': f'too many orders, max {settings.ORDERS_BATCH_MAX_SIZE}'},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(save_orders(payloads))
+
+
+@api_view(['GET'])
+def order_ticket_status(request, ticket):
+    ticket_status = get_order_spool().get(ticket)
+    if not ticket_status:
+        return Response({'error': f'ticket {ticket} not found'},
+                        status=status.HTTP_404_NOT_FOUND)
+    return Response(ticket_status)
@@ -0,0 +1,107 @@
+import numpy as np
+from django.db.models import Q
+
+from .models import Distance
+
+
+# WGS-84 ellipsoid
+EQUATORIAL_RADIUS_KM = 6378.137
+FLATTENING = 1 / 298.257223563
+
+
+def measure_distances(origin, destinations):
+    """Distances in km from the origin to every destination, as an array.
+
+    Points are (lat, lon) pairs in degrees. Lambert's formula for the
+    ellipsoid is computed for all destinations at once; it differs from
+    geopy's geodesic by less than 0.01% of the distance, which is under a
+    metre within a city, and by less than 0.2% for antipodal points.
+    """
+    destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    lat_a, lon_a = np.radians(origin)
+    lat_b, lon_b = np.radians(destinations).T
+
+    # Reduced latitudes turn the ellipsoid problem into a spherical one
+    beta_a = np.arctan((1 - FLATTENING) * np.tan(lat_a))
+    beta_b = np.arctan((1 - FLATTENING) * np.tan(lat_b))
+    p = (beta_a + beta_b) / 2
+    q = (beta_b - beta_a) / 2
+    # sin² and cos² of half the central angle, each a sum of non-negative
+    # terms, so neither loses precision near coincident or antipodal points
+    cos_lambda, sin_lambda = (np.cos((lon_b - lon_a) / 2) ** 2,
+                              np.sin((lon_b - lon_a) / 2) ** 2)
+    sin_half = np.sin(q) ** 2 * cos_lambda + np.cos(p) ** 2 * sin_lambda
+    cos_half = np.cos(q) ** 2 * cos_lambda + np.sin(p) ** 2 * sin_lambda
+    sigma = 2 * np.arctan2(np.sqrt(sin_half), np.sqrt(cos_half))
+
+    # A term whose denominator vanishes is dropped, as for coincident
+    # points, where it tends to zero
+    x = np.divide(
+        (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2,
+        cos_half, out=np.zeros_like(sigma), where=cos_half > 0)
+    y = np.divide(
+        (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2,
+        sin_half, out=np.zeros_like(sigma), where=sin_half > 0)
+    return EQUATORIAL_RADIUS_KM * (sigma - FLATTENING / 2 * (x + y))
+
+
+def get_distances(place_pairs):
+    """Distances in km between pairs of places, keyed by their id pairs.
+
+    Distances are read from the table, and the ones it does not have yet
+    are computed once and stored there. Pairs with a place the geocoder
+    has not found are left out.
+    """
+    places_by_key = {}
+    for place_a, place_b in place_pairs:
+        if None in (place_a.lat, place_a.lon, place_b.lat, place_b.lon):
+            continue
+        # The distance is symmetric, so the pair is stored once
+        if place_a.id > place_b.id:
+            place_a, place_b = place_b, place_a
+        places_by_key[place_a.id, place_b.id] = (place_a, place_b)
+
+    place_ids = {place_id for key in places_by_key for place_id in key}
+    stored = (
+        Distance.objects
+        .filter(place_a__in=place_ids, place_b__in=place_ids)
+        .values_list('place_a_id', 'place_b_id', 'km')
+    )
+    distances = {
+        (place_a_id, place_b_id): km
+        for place_a_id, place_b_id, km in stored
+        if (place_a_id, place_b_id) in places_by_key
+    }
+
+    missing_by_place = {}
+    for key, (place_a, place_b) in places_by_key.items():
+        if key not in distances:
+            missing_by_place.setdefault(place_a.id, (place_a, []))[1] \
+                .append(place_b)
+
+    new_distances = []
+    for place_a, places_b in missing_by_place.values():
+        kms = measure_distances(
+            (place_a.lat, place_a.lon),
+            [(place_b.lat, place_b.lon) for place_b in places_b])
+        new_distances.extend(
+            Distance(place_a=place_a, place_b=place_b, km=float(km))
+            for place_b, km in zip(places_b, kms)
+        )
+    if new_distances:
+        Distance.objects.bulk_create(new_distances, ignore_conflicts=True)
+    for new_distance in new_distances:
+        distances[new_distance.place_a.id, new_distance.place_b.id] = \
+            new_distance.km
+
+    distances.update({
+        (place_b_id, place_a_id): km
+        for (place_a_id, place_b_id), km in list(distances.items())
+    })
+    return distances
+
+
+def forget_distances(place_ids):
+    """Drop the stored distances of places whose coordinates changed."""
+    Distance.objects.filter(
+        Q(place_a__in=place_ids) | Q(place_b__in=place_ids)).delete()
@@ -0,0 +1,247 @@
+import functools
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_percentile(sorted_values, percent):
+    """Nearest-rank percentile of a non-empty sorted list."""
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def describe_error(error):
+    """Describe a request error without its URL, which holds the API key."""
+    description = type(error).__name__
+    response = getattr(error, 'response', None)
+    if response is not None:
+        description += f' {response.status_code}'
+    request = getattr(error, 'request', None)
+    if request is not None and request.url:
+        description += f' from {urlsplit(request.url).hostname}'
+    return description
+
+
+class GeocoderUnavailable(requests.RequestException):
+    """The circuit breaker is open and the geocoder is not called."""
+
+
+class CircuitBreaker:
+    """Fail fast after `threshold` failed calls in a row.
+
+    The breaker stays open for `cooldown` seconds, then lets one trial call
+    through: a success closes it, a failure opens it again.
+    """
+
+    def __init__(self, threshold, cooldown, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if self.clock() - self._opened_at < self.cooldown:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release(self):
+        """End a call that tells nothing about the geocoder's health."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.threshold:
+                self._opened_at = self.clock()
+            self._trial_running = False
+
+
+class GeocoderClient:
+    """Client of the Yandex geocoder.
+
+    Connections are kept alive in a pool, every request is bounded by
+    connect and read timeouts, and throttled or failed requests are retried
+    with exponential backoff and jitter. While the geocoder keeps failing,
+    the circuit breaker turns calls away without waiting for timeouts.
+    """
+
+    def __init__(self, apikey, base_url, connect_timeout, read_timeout,
+                 max_retries, backoff, max_backoff, breaker_threshold,
+                 breaker_cooldown, pool_size=4, sleep=time.sleep):
+        self.apikey = apikey
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.sleep = sleep
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._calls = 0
+        self._failures = 0
+        self._retries = 0
+        self._rejected = 0
+
+    def get_retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') \
+            if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.max_backoff)
+        # Full jitter keeps workers that failed together from retrying
+        # together
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+    def request(self, params):
+        if not self.breaker.allow():
+            with self._stats_lock:
+                self._rejected += 1
+            raise GeocoderUnavailable('geocoder circuit breaker is open')
+
+        started_at = time.perf_counter()
+        try:
+            response = self._request_with_retries(params)
+        except requests.HTTPError as error:
+            # A refused request, like a bad key, does not mean that the
+            # geocoder is down
+            if error.response.status_code in RETRY_STATUSES:
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+            self._record_call(started_at, failed=True)
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            self._record_call(started_at, failed=True)
+            raise
+        self.breaker.record_success()
+        self._record_call(started_at, failed=False)
+        return response
+
+    def _request_with_retries(self, params):
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.get(self.base_url, params=params,
+                                            timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if is_last_attempt:
+                    raise
+                delay = self.get_retry_delay(attempt)
+                logger.warning('Geocoder request failed with %s, retrying '
+                               'in %.2f s', describe_error(error), delay)
+            else:
+                if response.status_code not in RETRY_STATUSES \
+                        or is_last_attempt:
+                    response.raise_for_status()
+                    return response
+                delay = self.get_retry_delay(attempt, response)
+                logger.warning('Geocoder answered %d, retrying in %.2f s',
+                               response.status_code, delay)
+                response.close()
+
+            with self._stats_lock:
+                self._retries += 1
+            self.sleep(delay)
+
+    def _record_call(self, started_at, failed):
+        latency = time.perf_counter() - started_at
+        logger.debug('Geocoder call took %.1f ms', latency * 1000)
+        with self._stats_lock:
+            self._calls += 1
+            self._failures += failed
+            self._latencies.append(latency)
+
+    def get_stats(self):
+        """Counters and latency percentiles of the recent calls in ms."""
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'calls': self._calls,
+                'failures': self._failures,
+                'retries': self._retries,
+                'rejected': self._rejected,
+                'circuit': self.breaker.state,
+            }
+        if latencies:
+            stats.update({
+                'p50_ms': get_percentile(latencies, 50) * 1000,
+                'p95_ms': get_percentile(latencies, 95) * 1000,
+                'max_ms': latencies[-1] * 1000,
+            })
+        return stats
+
+    def fetch_coordinates(self, address):
+        response = self.request({
+            "geocode": address,
+            "apikey": self.apikey,
+            "format": "json",
+        })
+        found_places = response.json(
+        )['response']['GeoObjectCollection']['featureMember']
+
+        if not found_places:
+            return None
+
+        most_relevant = found_places[0]
+        lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
+        return lon, lat
+
+
+@functools.cache
+def get_geocoder():
+    return GeocoderClient(
+        apikey=os.environ['YANDEX_GEO_API'],
+        base_url=settings.GEOCODER_URL,
+        connect_timeout=settings.GEOCODER_CONNECT_TIMEOUT,
+        read_timeout=settings.GEOCODER_READ_TIMEOUT,
+        max_retries=settings.GEOCODER_MAX_RETRIES,
+        backoff=settings.GEOCODER_BACKOFF,
+        max_backoff=settings.GEOCODER_MAX_BACKOFF,
+        breaker_threshold=settings.GEOCODER_BREAKER_THRESHOLD,
+        breaker_cooldown=settings.GEOCODER_BREAKER_COOLDOWN,
+    )
@@ -0,0 +1,92 @@
+import datetime
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.db import connections, transaction
+
+from .distances import forget_distances
+from .geocoder import describe_error, get_geocoder
+from .models import Place, coordinates_changed
+
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='geocoder')
+
+_pending_addresses = set()
+_pending_lock = threading.Lock()
+
+
+def save_coordinates(address, coords):
+    lon, lat = map(float, coords) if coords else (None, None)
+    fields = {
+        'lon': lon,
+        'lat': lat,
+        'last_updated_at': datetime.date.today(),
+    }
+    places = Place.objects.filter(address=address)
+    place_ids = list(places.values_list('id', flat=True))
+    if place_ids:
+        places.update(**fields)
+        forget_distances(place_ids)
+        coordinates_changed.send(sender=Place, addresses=[address])
+    else:
+        Place.objects.create(name=address[:50], address=address, **fields)
+
+
+def geocode_address(address):
+    """Ask the geocoder for the address and save the answer to the places.
+
+    An address the geocoder does not know is saved without coordinates,
+    so that it is not asked for again.
+    """
+    coords = get_geocoder().fetch_coordinates(address)
+    save_coordinates(address, coords)
+    return coords
+
+
+def get_cached_places(addresses):
+    """Places of the already geocoded addresses, by address.
+
+    A place the geocoder has not found has no coordinates. Addresses that
+    have not been geocoded yet are left out.
+    """
+    places = (
+        Place.objects
+        .filter(address__in={address for address in addresses if address})
+        .only('id', 'address', 'lat', 'lon')
+        .order_by('-id')
+    )
+    return {place.address: place for place in places}
+
+
+def _geocode_in_background(address):
+    try:
+        if not Place.objects.filter(address=address).exists():
+            geocode_address(address)
+    except requests.RequestException as error:
+        logger.warning('Geocoding of %r failed with %s', address,
+                       describe_error(error))
+    except Exception:
+        logger.exception('Geocoding of %r failed', address)
+    finally:
+        with _pending_lock:
+            _pending_addresses.discard(address)
+        connections.close_all()
+
+
+def _submit(addresses):
+    with _pending_lock:
+        new_addresses = set(addresses) - _pending_addresses
+        _pending_addresses.update(new_addresses)
+    for address in new_addresses:
+        executor.submit(_geocode_in_background, address)
+
+
+def schedule_geocoding(addresses):
+    """Geocode the addresses in a background thread after the commit."""
+    addresses = {address for address in addresses if address}
+    if addresses:
+        transaction.on_commit(lambda: _submit(addresses))
@@ -0,0 +1,60 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from geopy import distance
+
+from places.distances import measure_distances
+
+
+def make_points(count, seed):
+    random_generator = random.Random(seed)
+    return [
+        (55.75 + random_generator.uniform(-0.3, 0.3),
+         37.62 + random_generator.uniform(-0.5, 0.5))
+        for _ in range(count)
+    ]
+
+
+def measure_with_geopy(origin, destinations):
+    return [distance.distance(origin, destination).km
+            for destination in destinations]
+
+
+def measure_time(func, *args, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started_at)
+    return result, best
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость и точность расчёта расстояний с geopy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10, 100, 10000])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        origin = (55.75, 37.62)
+        self.stdout.write(f'{"точек":>8} {"geopy, мс":>11} {"numpy, мс":>11} '
+                          f'{"ускорение":>10} {"ошибка, м":>10}')
+        for size in options['sizes']:
+            destinations = make_points(size, options['seed'])
+            geopy_kms, geopy_time = measure_time(
+                measure_with_geopy, origin, destinations, repeat=repeat)
+            numpy_kms, numpy_time = measure_time(
+                measure_distances, origin, destinations, repeat=repeat)
+            max_error_m = max(
+                abs(geopy_km - numpy_km) * 1000
+                for geopy_km, numpy_km in zip(geopy_kms, numpy_kms)
+            )
+            self.stdout.write(
+                f'{size:>8} {geopy_time * 1000:>11.2f} '
+                f'{numpy_time * 1000:>11.3f} '
+                f'{geopy_time / numpy_time:>9.0f}x {max_error_m:>10.3f}')
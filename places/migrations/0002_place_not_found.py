@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('places', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='place',
+            name='address',
+            field=models.CharField(db_index=True, max_length=200, verbose_name='Адрес'),
+        ),
+        migrations.AlterField(
+            model_name='place',
+            name='lat',
+            field=models.FloatField(blank=True, help_text='Пусто, если геокодер не нашёл адрес', null=True, verbose_name='Широта'),
+        ),
+        migrations.AlterField(
+            model_name='place',
+            name='lon',
+            field=models.FloatField(blank=True, help_text='Пусто, если геокодер не нашёл адрес', null=True, verbose_name='Долгота'),
+        ),
+    ]
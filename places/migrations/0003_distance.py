@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('places', '0002_place_not_found'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Distance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('km', models.FloatField(verbose_name='Расстояние, км')),
+                ('place_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='places.place', verbose_name='Место А')),
+                ('place_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='places.place', verbose_name='Место Б')),
+            ],
+            options={
+                'verbose_name': 'Расстояние',
+                'verbose_name_plural': 'Расстояния',
+                'constraints': [models.UniqueConstraint(fields=('place_a', 'place_b'), name='unique_distance_places')],
+            },
+        ),
+    ]
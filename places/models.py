@@ -1,4 +1,9 @@
 from django.db import models
+from django.dispatch import Signal
+
+
+# Sent with the `addresses` whose coordinates were saved or changed
+coordinates_changed = Signal()
 
 
 class Place(models.Model):
@@ -8,11 +13,14 @@ class Place(models.Model):
     )
     address = models.CharField(
         'Адрес',
-        max_length=100,
+        max_length=200,
+        db_index=True,
     )
 
-    lat = models.FloatField(verbose_name='Широта')
-    lon = models.FloatField(verbose_name='Долгота')
+    lat = models.FloatField(verbose_name='Широта', null=True, blank=True,
+                            help_text='Пусто, если геокодер не нашёл адрес')
+    lon = models.FloatField(verbose_name='Долгота', null=True, blank=True,
+                            help_text='Пусто, если геокодер не нашёл адрес')
 
     last_updated_at = models.DateField(verbose_name="Дата запроса к геокодеру",
                                        db_index=True)
@@ -23,3 +31,30 @@ class Place(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class Distance(models.Model):
+    place_a = models.ForeignKey(
+        Place,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Место А',
+    )
+    place_b = models.ForeignKey(
+        Place,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Место Б',
+    )
+    km = models.FloatField('Расстояние, км')
+
+    class Meta:
+        verbose_name = 'Расстояние'
+        verbose_name_plural = 'Расстояния'
+        constraints = [
+            models.UniqueConstraint(fields=['place_a', 'place_b'],
+                                    name='unique_distance_places'),
+        ]
+
+    def __str__(self):
+        return f'{self.place_a} - {self.place_b}: {self.km:.3f} км'
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .distances import forget_distances
+from .models import Place, coordinates_changed
+
+
+@receiver(post_save, sender=Place)
+def forget_place_distances(sender, instance, created, **kwargs):
+    if not created:
+        forget_distances([instance.id])
+
+
+@receiver(post_save, sender=Place)
+def announce_place_coordinates(sender, instance, **kwargs):
+    coordinates_changed.send(sender=Place, addresses=[instance.address])
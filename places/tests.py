@@ -1,3 +1,226 @@
-from django.test import TestCase
+import json
+import random
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.test import SimpleTestCase
+from geopy import distance
+
+from places.distances import measure_distances
+from places.geocoder import GeocoderClient, GeocoderUnavailable
+from places.geocoding import _geocode_in_background
+
+
+class MeasureDistancesTest(SimpleTestCase):
+    def assert_close_to_geodesic(self, origin, destinations, max_error_km):
+        kms = measure_distances(origin, destinations)
+        for destination, km in zip(destinations, kms):
+            geodesic_km = distance.distance(origin, destination).km
+            self.assertLessEqual(abs(km - geodesic_km),
+                                 max(max_error_km, geodesic_km * 1e-4))
+
+    def test_matches_geodesic_within_city(self):
+        random_generator = random.Random(1)
+        origin = (55.75, 37.62)
+        destinations = [
+            (55.75 + random_generator.uniform(-0.3, 0.3),
+             37.62 + random_generator.uniform(-0.5, 0.5))
+            for _ in range(500)
+        ]
+        self.assert_close_to_geodesic(origin, destinations,
+                                      max_error_km=0.001)
+
+    def test_matches_geodesic_across_the_globe(self):
+        random_generator = random.Random(1)
+        origin = (10.0, 20.0)
+        destinations = [
+            (random_generator.uniform(-80, 80),
+             random_generator.uniform(-170, 170))
+            for _ in range(500)
+        ]
+        self.assert_close_to_geodesic(origin, destinations,
+                                      max_error_km=0.001)
+
+    def test_same_point(self):
+        self.assertEqual(list(measure_distances((55.75, 37.62),
+                                                [(55.75, 37.62)])),
+                         [0.0])
+
+    def test_nearly_same_points(self):
+        origin = (55.75, 37.62)
+        destinations = [(55.75 + 1e-12, 37.62), (55.75, 37.62 + 1e-12)]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assert_close_to_geodesic(origin, destinations,
+                                          max_error_km=1e-9)
+
+    def test_antipodal_points(self):
+        origin = (0.0, 0.0)
+        destinations = [(0.0, 180.0), (1e-9, 180.0), (-1e-9, -180.0),
+                        (0.0, 180.0 - 1e-9)]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            kms = measure_distances(origin, destinations)
+        for destination, km in zip(destinations, kms):
+            geodesic_km = distance.distance(origin, destination).km
+            self.assertLessEqual(abs(km - geodesic_km), geodesic_km * 0.002)
+        self.assertLessEqual(
+            abs(measure_distances((90.0, 0.0), [(-90.0, 0.0)])[0]
+                - distance.distance((90.0, 0.0), (-90.0, 0.0)).km),
+            0.1)
+
+
+class StandInGeocoder(BaseHTTPRequestHandler):
+    """Answers with the scripted (status, delay) replies, then with 200."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.client_ports.append(self.client_address[1])
+        status, delay = server.replies.pop(0) if server.replies else (200, 0)
+        time.sleep(delay)
+        body = json.dumps({'response': {'GeoObjectCollection': {
+            'featureMember': [{'GeoObject': {'Point': {'pos': '37.6 55.7'}}}],
+        }}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GeocoderClientTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInGeocoder)
+        self.server.replies = []
+        self.server.client_ports = []
+        # Clients that time out drop the connection before the answer
+        self.server.handle_error = lambda request, client_address: None
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def make_client(self, **kwargs):
+        options = {
+            'apikey': 'SECRETKEY123',
+            'base_url': f'http://127.0.0.1:{self.server.server_port}/1.x',
+            'connect_timeout': 1,
+            'read_timeout': 1,
+            'max_retries': 2,
+            'backoff': 0.01,
+            'max_backoff': 0.1,
+            'breaker_threshold': 2,
+            'breaker_cooldown': 60,
+            'sleep': lambda seconds: None,
+        }
+        options.update(kwargs)
+        client = GeocoderClient(**options)
+        self.addCleanup(client.session.close)
+        return client
+
+    def test_keeps_connection_alive(self):
+        client = self.make_client()
+
+        for _ in range(3):
+            self.assertEqual(client.fetch_coordinates('Москва'),
+                             ('37.6', '55.7'))
+
+        self.assertEqual(len(set(self.server.client_ports)), 1)
+        stats = client.get_stats()
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['failures'], 0)
+        self.assertIn('p95_ms', stats)
+
+    def test_retries_unavailable_geocoder(self):
+        self.server.replies = [(503, 0), (429, 0)]
+        client = self.make_client()
+
+        with self.assertLogs('places.geocoder', 'WARNING'):
+            coords = client.fetch_coordinates('Москва')
+
+        self.assertEqual(coords, ('37.6', '55.7'))
+        self.assertEqual(client.get_stats()['retries'], 2)
+
+    def test_does_not_retry_refused_request(self):
+        self.server.replies = [(403, 0)]
+        client = self.make_client()
+
+        with self.assertRaises(requests.HTTPError):
+            client.fetch_coordinates('Москва')
+        self.assertEqual(len(self.server.client_ports), 1)
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_bounds_slow_answer_with_read_timeout(self):
+        self.server.replies = [(200, 0.5)]
+        client = self.make_client(read_timeout=0.1, max_retries=0)
+
+        with self.assertRaises(requests.Timeout):
+            client.fetch_coordinates('Москва')
+
+    def test_breaker_fails_fast_until_cooldown(self):
+        now = [0]
+        self.server.replies = [(500, 0)] * 2
+        client = self.make_client(max_retries=0)
+        client.breaker.clock = lambda: now[0]
+
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                client.fetch_coordinates('Москва')
+        with self.assertRaises(GeocoderUnavailable):
+            client.fetch_coordinates('Москва')
+        self.assertEqual(len(self.server.client_ports), 2)
+        self.assertEqual(client.get_stats()['rejected'], 1)
+
+        now[0] = 60
+        self.assertEqual(client.breaker.state, 'half-open')
+        self.assertEqual(client.fetch_coordinates('Москва'),
+                         ('37.6', '55.7'))
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_keeps_trial_open_after_refused_request(self):
+        now = [0]
+        self.server.replies = [(500, 0), (500, 0), (403, 0)]
+        client = self.make_client(max_retries=0)
+        client.breaker.clock = lambda: now[0]
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                client.fetch_coordinates('Москва')
+
+        now[0] = 60
+        with self.assertRaises(requests.HTTPError):
+            client.fetch_coordinates('Москва')
+
+        self.assertEqual(client.breaker.state, 'half-open')
+        self.assertEqual(client.fetch_coordinates('Москва'),
+                         ('37.6', '55.7'))
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_keeps_api_key_out_of_logs(self):
+        self.server.replies = [(503, 0)] * 3
+        client = self.make_client(
+            base_url=f'http://127.0.0.1:{self.server.server_port}/1.x')
+        unreachable_client = self.make_client(
+            base_url='http://127.0.0.1:1/1.x', max_retries=1)
+
+        with self.assertLogs('places', 'WARNING') as logs, \
+                mock.patch('places.geocoding.get_geocoder',
+                           side_effect=[client, unreachable_client]), \
+                mock.patch('places.geocoding.Place.objects') as places:
+            places.filter.return_value.exists.return_value = False
+            _geocode_in_background('Москва')
+            _geocode_in_background('Москва, Тверская')
+
+        output = '\n'.join(logs.output)
+        self.assertIn('HTTPError 503 from 127.0.0.1', output)
+        self.assertIn('ConnectionError from 127.0.0.1', output)
+        self.assertNotIn('SECRETKEY123', output)
@@ -1,3 +1,522 @@
-from django.test import TestCase
+import datetime
+import random
+from collections import Counter
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from foodcartapp.availability import availability_cache, availability_index
+from foodcartapp.dispatch import assign_greedily, optimize_assignment
+from foodcartapp.locator import RestaurantLocator, locations_cache
+from foodcartapp.locator import restaurant_locator
+from foodcartapp.models import Order, OrderItem, Product, Restaurant
+from foodcartapp.models import RestaurantMenuItem
+from places.distances import measure_distances
+from places.models import Distance, Place
+
+
+class ViewOrdersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', is_staff=True)
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}',
+                                   price=100,
+                                   image='burger.jpg')
+            for number in range(3)
+        ]
+        cls.restaurants = [
+            Restaurant.objects.create(name=f'Ресторан {number}',
+                                      address=f'Москва, улица {number}')
+            for number in range(3)
+        ]
+        for restaurant in cls.restaurants:
+            Place.objects.create(name=restaurant.address,
+                                 address=restaurant.address,
+                                 lat=55.75,
+                                 lon=37.6 + restaurant.id / 100,
+                                 last_updated_at=datetime.date.today())
+            for product in cls.products:
+                RestaurantMenuItem.objects.create(restaurant=restaurant,
+                                                  product=product)
+
+    def setUp(self):
+        # The availability index outlives the rolled back test transactions
+        cache.clear()
+        availability_index.restaurant_ids()
+        restaurant_locator.located([])
+
+    def create_orders(self, count, status='proc'):
+        for number in range(count):
+            address = f'Москва, проспект {Order.objects.count()}'
+            Place.objects.create(name=address,
+                                 address=address,
+                                 lat=55.7,
+                                 lon=37.5,
+                                 last_updated_at=datetime.date.today())
+            order = Order.objects.create(firstname='Иван',
+                                         lastname='Иванов',
+                                         phonenumber='+79001234567',
+                                         address=address,
+                                         status=status,
+                                         restaurant=self.restaurants[0])
+            for product in self.products[:number % 3 + 1]:
+                OrderItem.objects.create(order=order,
+                                         product=product,
+                                         quantity=1,
+                                         price_fixed=product.price)
+
+    def place_order(self, products):
+        """Place an order the way the site does, through the API."""
+        response = self.client.post('/api/order/', {
+            'firstname': 'Иван',
+            'lastname': 'Иванов',
+            'phonenumber': '+79001234567',
+            'address': 'Москва, проспект 1',
+            'products': [{'product': product.id, 'quantity': 1}
+                         for product in products],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return Order.objects.get(id=response.json()['id'])
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('restaurateur:view_orders'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_orders(self):
+        self.client.force_login(self.manager)
+        self.create_orders(2)
+        self.create_orders(1, status='cook')
+        queries_for_few_orders = self.count_queries()
+
+        self.create_orders(20)
+        self.create_orders(5, status='cook')
+        self.assertEqual(self.count_queries(), queries_for_few_orders)
+
+    def count_version_checks(self, versioned_cache):
+        with mock.patch.object(versioned_cache, 'get_version',
+                               wraps=versioned_cache.get_version) as checks:
+            response = self.client.get(reverse('restaurateur:view_orders'))
+        self.assertEqual(response.status_code, 200)
+        return checks.call_count
+
+    def test_checks_availability_version_once_per_page(self):
+        self.client.force_login(self.manager)
+        self.create_orders(2)
+        checks_for_few_orders = self.count_version_checks(availability_cache)
+
+        self.create_orders(20)
+        self.assertEqual(self.count_version_checks(availability_cache),
+                         checks_for_few_orders)
+
+    def test_checks_locations_version_once_per_page(self):
+        self.client.force_login(self.manager)
+        self.create_orders(2)
+        checks_for_few_orders = self.count_version_checks(locations_cache)
+
+        self.create_orders(20)
+        self.assertEqual(self.count_version_checks(locations_cache),
+                         checks_for_few_orders)
+
+    def test_lists_restaurants_that_have_all_products(self):
+        self.client.force_login(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(restaurant=self.restaurants[1],
+                                              product=self.products[2]) \
+                .update(availability=False)
+        self.create_orders(3)
+
+        response = self.client.get(reverse('restaurateur:view_orders'))
+        restaurants_by_order = {
+            item['order'].order_items.count(): item['restaurants']
+            for item in response.context['order_items']
+        }
+
+        self.assertEqual(len(restaurants_by_order[3]), 2)
+        self.assertEqual(len(restaurants_by_order[1]), 3)
+        self.assertNotIn('? км', restaurants_by_order[1][0])
+
+    def test_suggests_restaurants_for_orders_from_site(self):
+        order = self.place_order(self.products[:2])
+        self.client.force_login(self.manager)
+
+        response = self.client.get(reverse('restaurateur:view_orders'))
+
+        self.assertEqual(order.status, 'proc')
+        [item] = response.context['order_items']
+        self.assertTrue(item['proc'])
+        self.assertEqual(len(item['restaurants']), 3)
+
+    def test_marks_orders_with_address_not_geocoded_yet(self):
+        self.client.force_login(self.manager)
+        self.create_orders(1)
+        Order.objects.update(address='Москва, новый адрес')
+
+        with mock.patch(
+                'places.geocoder.GeocoderClient.fetch_coordinates') as fetch, \
+                self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.get(reverse('restaurateur:view_orders'))
+
+        fetch.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        [item] = response.context['order_items']
+        self.assertTrue(item['geocoding'])
+        self.assertTrue(all(restaurant.endswith('? км')
+                            for restaurant in item['restaurants']))
+
+    def test_marks_orders_without_restaurants_not_geocoded_yet(self):
+        self.client.force_login(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(product=self.products[0]) \
+                .update(availability=False)
+        self.create_orders(1)
+        Order.objects.update(address='Москва, новый адрес')
+
+        response = self.client.get(reverse('restaurateur:view_orders'))
+
+        [item] = response.context['order_items']
+        self.assertEqual(item['restaurants'], [])
+        self.assertContains(response, 'Координаты адреса ещё определяются')
+        self.assertNotContains(response, 'Ошибка определения координат')
+
+    def test_stores_distances_for_orders_from_site(self):
+        Place.objects.create(name='Москва, проспект 1',
+                             address='Москва, проспект 1',
+                             lat=55.7,
+                             lon=37.5,
+                             last_updated_at=datetime.date.today())
+        self.place_order(self.products[:1])
+        Order.objects.create(firstname='Пётр',
+                             lastname='Петров',
+                             phonenumber='+79001234568',
+                             address='Москва, проспект 2',
+                             status='cook',
+                             restaurant=self.restaurants[0])
+        self.client.force_login(self.manager)
+
+        response = self.client.get(reverse('restaurateur:view_orders'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['order_items']), 2)
+        self.assertEqual(Distance.objects.count(), 3)
+
+    def test_reads_stored_distances(self):
+        self.client.force_login(self.manager)
+        self.create_orders(3)
+        self.client.get(reverse('restaurateur:view_orders'))
+        self.assertEqual(Distance.objects.count(), 9)
+
+        with mock.patch('places.distances.measure_distances') as measure:
+            self.client.get(reverse('restaurateur:view_orders'))
+        measure.assert_not_called()
+
+        place = Place.objects.get(address=self.restaurants[0].address)
+        place.lon += 0.1
+        place.save()
+        self.assertEqual(Distance.objects.count(), 6)
+
+    @override_settings(MANAGER_ORDERS_PAGE_SIZE=4)
+    def test_pages_through_all_orders_once(self):
+        self.client.force_login(self.manager)
+        self.create_orders(5, status='cook')
+        self.create_orders(6)
+        self.create_orders(2, status='end')
+
+        order_ids = []
+        url = reverse('restaurateur:view_orders')
+        while url:
+            response = self.client.get(url)
+            order_ids += [item['order'].id
+                          for item in response.context['order_items']]
+            next_page_url = response.context['next_page_url']
+            url = next_page_url and reverse('restaurateur:view_orders') \
+                + next_page_url
+
+        self.assertEqual(order_ids, list(
+            Order.objects.exclude(status='end').queue()
+            .values_list('id', flat=True)))
+        self.assertEqual(len(order_ids), 11)
+
+    @override_settings(MANAGER_ORDERS_PAGE_SIZE=4)
+    def test_pages_through_orders_without_status(self):
+        self.client.force_login(self.manager)
+        self.create_orders(6, status='cook')
+        # Orders saved before the status got its default
+        self.create_orders(4, status='')
+
+        order_ids = []
+        url = reverse('restaurateur:view_orders')
+        while url:
+            response = self.client.get(url)
+            order_ids += [item['order'].id
+                          for item in response.context['order_items']]
+            next_page_url = response.context['next_page_url']
+            url = next_page_url and reverse('restaurateur:view_orders') \
+                + next_page_url
+
+        self.assertEqual(sorted(order_ids),
+                         list(Order.objects.order_by('id')
+                              .values_list('id', flat=True)))
+
+    def test_filters_orders(self):
+        self.client.force_login(self.manager)
+        self.create_orders(2, status='cook')
+        self.create_orders(3)
+        Order.objects.filter(status='proc').update(payment_type='epay')
+
+        response = self.client.get(reverse('restaurateur:view_orders'), {
+            'status': 'proc',
+            'payment_type': 'epay',
+            'date_from': datetime.date.today().isoformat(),
+            'date_to': datetime.date.today().isoformat(),
+        })
+        self.assertEqual(len(response.context['order_items']), 3)
+
+        response = self.client.get(reverse('restaurateur:view_orders'), {
+            'date_to': (datetime.date.today()
+                        - datetime.timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(response.context['order_items'], [])
+
+    def test_dispatches_orders_within_capacity(self):
+        self.client.force_login(self.manager)
+        Restaurant.objects.update(dispatch_capacity=1)
+        self.create_orders(4)
+        Order.objects.update(restaurant=None)
+
+        response = self.client.post(reverse('restaurateur:dispatch_orders'))
+
+        self.assertRedirects(response, reverse('restaurateur:view_orders'))
+        cooked_orders = Order.objects.filter(status='cook')
+        self.assertEqual(cooked_orders.count(), 3)
+        self.assertEqual(
+            len(set(cooked_orders.values_list('restaurant', flat=True))), 3)
+        self.assertTrue(Order.objects.filter(status='proc',
+                                             restaurant__isnull=True).exists())
+
+    def test_dispatches_orders_from_site(self):
+        Place.objects.create(name='Москва, проспект 1',
+                             address='Москва, проспект 1',
+                             lat=55.7,
+                             lon=37.5,
+                             last_updated_at=datetime.date.today())
+        order = self.place_order(self.products)
+        self.client.force_login(self.manager)
+
+        self.client.post(reverse('restaurateur:dispatch_orders'))
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cook')
+        self.assertIn(order.restaurant, self.restaurants)
+
+
+class ProductsAvailabilityTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', is_staff=True)
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}',
+                                   price=100,
+                                   image='burger.jpg')
+            for number in range(3)
+        ]
+        cls.restaurants = [
+            Restaurant.objects.create(name=f'Ресторан {number}')
+            for number in range(2)
+        ]
+        for product in cls.products[:2]:
+            for restaurant in cls.restaurants:
+                RestaurantMenuItem.objects.create(restaurant=restaurant,
+                                                  product=product)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.manager)
+
+    def post_changes(self, changes):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('restaurateur:update_products_availability'),
+                {'changes': changes},
+                content_type='application/json',
+            )
+
+    def get_availability(self):
+        return set(
+            RestaurantMenuItem.objects
+            .filter(availability=True)
+            .values_list('restaurant_id', 'product_id')
+        )
+
+    def test_applies_changes_in_bulk(self):
+        first, second, new = self.products
+        response = self.post_changes([
+            {'restaurant': self.restaurants[0].id, 'product': first.id,
+             'availability': False},
+            {'restaurant': self.restaurants[1].id, 'product': second.id,
+             'availability': True},
+            {'restaurant': self.restaurants[1].id, 'product': new.id,
+             'availability': True},
+        ])
+
+        self.assertEqual(response.json(), {'updated': 1, 'created': 1})
+        self.assertEqual(self.get_availability(), {
+            (self.restaurants[0].id, second.id),
+            (self.restaurants[1].id, first.id),
+            (self.restaurants[1].id, second.id),
+            (self.restaurants[1].id, new.id),
+        })
+        new.refresh_from_db()
+        self.assertTrue(new.is_available)
+
+    def test_sells_out_product_everywhere(self):
+        self.post_changes([{'product': self.products[0].id,
+                            'availability': False}])
+
+        self.assertEqual(self.get_availability(), {
+            (restaurant.id, self.products[1].id)
+            for restaurant in self.restaurants
+        })
+        self.products[0].refresh_from_db()
+        self.assertFalse(self.products[0].is_available)
+
+    def test_closes_restaurant(self):
+        response = self.post_changes([{'restaurant': self.restaurants[0].id,
+                                       'availability': False}])
+
+        self.assertEqual(response.json(), {'updated': 2, 'created': 0})
+        self.assertEqual(self.get_availability(), {
+            (self.restaurants[1].id, product.id)
+            for product in self.products[:2]
+        })
+
+    def test_shows_availability_matrix(self):
+        self.post_changes([{'restaurant': self.restaurants[1].id,
+                            'product': self.products[0].id,
+                            'availability': False}])
+
+        response = self.client.get(reverse('restaurateur:ProductsView'))
+
+        rows = [
+            (product['id'], [available for _, available in availability])
+            for product, availability
+            in response.context['products_with_restaurant_availability']
+        ]
+        self.assertEqual(rows, [
+            (self.products[0].id, [True, False]),
+            (self.products[1].id, [True, True]),
+            (self.products[2].id, [False, False]),
+        ])
+
+    @override_settings(MANAGER_PRODUCTS_PAGE_SIZE=2)
+    def test_pages_products(self):
+        response = self.client.get(reverse('restaurateur:ProductsView'))
+        self.assertEqual(len(list(
+            response.context['products_with_restaurant_availability'])), 2)
+        self.assertEqual(response.context['next_page_url'],
+                         f'?cursor={self.products[1].id}')
+
+    def test_shows_first_page_for_invalid_cursor(self):
+        for cursor in ['abc', '²']:
+            response = self.client.get(reverse('restaurateur:ProductsView'),
+                                       {'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['is_first_page'])
+
+    def test_rejects_unknown_ids(self):
+        response = self.post_changes([{'restaurant': 1000,
+                                       'availability': False}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('1000', response.json()['error'])
+
+
+class RestaurantLocatorTest(SimpleTestCase):
+    def setUp(self):
+        random_generator = random.Random(1)
+        self.points = {
+            restaurant_id: (55.75 + random_generator.uniform(-0.5, 0.5),
+                            37.62 + random_generator.uniform(-0.8, 0.8))
+            for restaurant_id in range(1, 501)
+        }
+        self.points[501] = (59.94, 30.31)
+        self.locator = RestaurantLocator()
+        self.locator.load(self.points)
+
+    def find_by_scan(self, point, k=None, radius_km=None):
+        kms = measure_distances(point, list(self.points.values()))
+        found = sorted(
+            (km, restaurant_id)
+            for restaurant_id, km in zip(self.points, kms)
+            if radius_km is None or km <= radius_km
+        )
+        return [restaurant_id for _, restaurant_id in found][:k]
+
+    def find(self, point, **kwargs):
+        with mock.patch.object(self.locator, '_ensure_fresh'):
+            return [restaurant_id for restaurant_id, _
+                    in self.locator.nearest(point, **kwargs)]
+
+    def test_finds_same_restaurants_as_full_scan(self):
+        for point in [(55.75, 37.62), (55.3, 37.0), (59.9, 30.3)]:
+            self.assertEqual(self.find(point, k=7),
+                             self.find_by_scan(point, k=7))
+            self.assertEqual(self.find(point, radius_km=8),
+                             self.find_by_scan(point, radius_km=8))
+
+    def test_moves_and_drops_restaurants(self):
+        self.locator.update_restaurants({1: (59.94, 30.32), 501: None})
+        self.assertEqual(self.find((59.94, 30.31), k=1), [1])
+        self.assertNotIn(501, self.find((59.94, 30.31)))
+
+
+class OptimizeAssignmentTest(SimpleTestCase):
+    def test_swaps_orders_greedy_got_wrong(self):
+        costs = {
+            'a': {'x': 1, 'y': 10},
+            'b': {'x': 2, 'y': 100},
+        }
+        self.assertEqual(assign_greedily(costs, {'x': 1, 'y': 1}),
+                         {'a': 'x', 'b': 'y'})
+        self.assertEqual(
+            optimize_assignment(costs, {'x': 1, 'y': 1}, time_budget=1),
+            {'a': 'y', 'b': 'x'})
+
+    def test_makes_room_for_unassigned_orders(self):
+        costs = {
+            'a': {'x': 1, 'y': 2},
+            'b': {'x': 1.5},
+        }
+        self.assertEqual(
+            optimize_assignment(costs, {'x': 1, 'y': 1}, time_budget=1),
+            {'a': 'y', 'b': 'x'})
+
+    def test_respects_capacities(self):
+        random_generator = random.Random(1)
+        costs = {
+            order_id: {
+                restaurant_id: random_generator.uniform(0, 20)
+                for restaurant_id in random_generator.sample(range(30), 5)
+            }
+            for order_id in range(300)
+        }
+        capacities = {restaurant_id: 8 for restaurant_id in range(30)}
+
+        assignment = optimize_assignment(costs, capacities, time_budget=1)
+
+        loads = Counter(assignment.values())
+        self.assertTrue(all(loads[restaurant_id] <= capacity
+                            for restaurant_id, capacity in capacities.items()))
+        self.assertLessEqual(
+            sum(costs[order_id][restaurant_id]
+                for order_id, restaurant_id in assignment.items()),
+            sum(costs[order_id][restaurant_id]
+                for order_id, restaurant_id
+                in assign_greedily(costs, capacities).items()))
@@ -1,19 +1,27 @@
+import datetime
+import json
+
 from django import forms
+from django.conf import settings
+from django.contrib import messages
+from django.http import JsonResponse
 from django.shortcuts import redirect, render
+from django.utils import timezone
 from django.views import View
+from django.views.decorators.http import require_POST
 from django.urls import reverse_lazy
 from django.contrib.auth.decorators import user_passes_test
 
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
 from dotenv import load_dotenv
-from geopy import distance
-import os
-import requests
-import datetime
 
-from foodcartapp.models import Product, Restaurant, Order
-from places.models import Place
+from foodcartapp.availability import availability_index
+from foodcartapp.dispatch import apply_dispatch, plan_dispatch
+from foodcartapp.locator import restaurant_locator
+from foodcartapp.models import Order, Product, Restaurant, RestaurantMenuItem
+from places.distances import get_distances
+from places.geocoding import get_cached_places, schedule_geocoding
 
 load_dotenv()
 
@@ -35,6 +43,33 @@ class Login(forms.Form):
     )
 
 
+class OrdersFilter(forms.Form):
+    status = forms.ChoiceField(
+        label='Статус', required=False,
+        choices=[('', 'Все')] + [
+            (status, name) for status, name in Order.STATUS_CHOICES
+            if status != 'end'
+        ],
+    )
+    payment_type = forms.ChoiceField(
+        label='Способ оплаты', required=False,
+        choices=[('', 'Любой')] + Order.PAYMENT_CHOICES,
+    )
+    restaurant = forms.TypedChoiceField(
+        label='Ресторан', required=False, coerce=int, empty_value=None)
+    date_from = forms.DateField(
+        label='Создан с', required=False,
+        widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(
+        label='по', required=False,
+        widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def __init__(self, *args, restaurants, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['restaurant'].choices = [('', 'Любой')] + [
+            (restaurant.id, restaurant.name) for restaurant in restaurants]
+
+
 class LoginView(View):
     def get(self, request, *args, **kwargs):
         form = Login()
@@ -70,28 +105,99 @@ def is_manager(user):
     return user.is_staff  # FIXME replace with specific permission
 
 
+class ProductsRows:
+    """Rows of the products matrix, built as the template renders them,
+    so the page never holds the whole matrix."""
+
+    def __init__(self, products, restaurant_ids):
+        self.products = products
+        self.restaurant_ids = restaurant_ids
+
+    def __iter__(self):
+        image_storage = Product._meta.get_field('image').storage
+        availability_rows = availability_index.iter_availability_rows(
+            [product['id'] for product in self.products], self.restaurant_ids)
+        for product, availability in zip(self.products, availability_rows):
+            product['image_url'] = image_storage.url(product['image'])
+            yield product, list(zip(self.restaurant_ids, availability))
+
+
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_products(request):
-    restaurants = list(Restaurant.objects.order_by('name'))
-    products = list(Product.objects.prefetch_related('menu_items'))
+    restaurants = list(Restaurant.objects.order_by('name').only('id', 'name'))
 
-    products_with_restaurant_availability = []
-    for product in products:
-        availability = {
-            item.restaurant_id: item.availability for item in product.menu_items.all()}
-        ordered_availability = [availability.get(
-            restaurant.id, False) for restaurant in restaurants]
-
-        products_with_restaurant_availability.append(
-            (product, ordered_availability)
-        )
+    products = Product.objects.order_by('id')
+    try:
+        after_id = int(request.GET.get('cursor', ''))
+    except ValueError:
+        after_id = None
+    if after_id is not None:
+        products = products.filter(id__gt=after_id)
+    page_size = settings.MANAGER_PRODUCTS_PAGE_SIZE
+    products = list(
+        products.values('id', 'name', 'category__name', 'price', 'image')
+        [:page_size + 1]
+    )
+    next_page_url = None
+    if len(products) > page_size:
+        products = products[:page_size]
+        next_page_url = f'?cursor={products[-1]["id"]}'
 
     return render(request, template_name="products_list.html", context={
-        'products_with_restaurant_availability': products_with_restaurant_availability,
+        'products_with_restaurant_availability': ProductsRows(
+            products, [restaurant.id for restaurant in restaurants]),
         'restaurants': restaurants,
+        'next_page_url': next_page_url,
+        'is_first_page': after_id is None,
     })
 
 
+def parse_availability_changes(data):
+    changes = data.get('changes') if isinstance(data, dict) else None
+    if not isinstance(changes, list) or not changes:
+        raise ValueError('expected a non-empty list of changes')
+
+    parsed_changes = []
+    for change in changes:
+        if not isinstance(change, dict):
+            raise ValueError('every change must be an object')
+        restaurant_id = change.get('restaurant')
+        product_id = change.get('product')
+        availability = change.get('availability')
+        for object_id in (restaurant_id, product_id):
+            if object_id is not None and (not isinstance(object_id, int)
+                                          or isinstance(object_id, bool)):
+                raise ValueError('restaurant and product must be ids')
+        if restaurant_id is None and product_id is None:
+            raise ValueError('every change needs a restaurant or a product')
+        if not isinstance(availability, bool):
+            raise ValueError('availability must be true or false')
+        parsed_changes.append((restaurant_id, product_id, availability))
+
+    for model, index in ((Restaurant, 0), (Product, 1)):
+        object_ids = {change[index] for change in parsed_changes} - {None}
+        unknown_ids = object_ids - set(
+            model.objects.filter(id__in=object_ids)
+            .values_list('id', flat=True))
+        if unknown_ids:
+            raise ValueError(f'unknown {model._meta.model_name} ids: '
+                             f'{sorted(unknown_ids)}')
+    return parsed_changes
+
+
+@require_POST
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def update_products_availability(request):
+    try:
+        changes = parse_availability_changes(json.loads(request.body))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    updated_count, created_count = \
+        RestaurantMenuItem.objects.set_availability(changes)
+    return JsonResponse({'updated': updated_count, 'created': created_count})
+
+
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_restaurants(request):
     return render(request, template_name="restaurants_list.html", context={
@@ -99,134 +205,188 @@ def view_restaurants(request):
     })
 
 
-def save_coordinates(address, coords, place=None):
-    if place:
-        place.update(lon=coords[0],
-                     lat=coords[1],
-                     last_updated_at=datetime.date.today())
-    else:
-        Place.objects.create(name=address,
-                             address=address,
-                             lon=coords[0],
-                             lat=coords[1],
-                             last_updated_at=datetime.date.today())
-
-
-def fetch_coordinates(apikey, address):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(base_url, params={
-        "geocode": address,
-        "apikey": apikey,
-        "format": "json",
-    })
-    response.raise_for_status()
-    found_places = response.json(
-    )['response']['GeoObjectCollection']['featureMember']
-
-    if not found_places:
-        return None
-
-    most_relevant = found_places[0]
-    lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
-    return lon, lat
-
-
-def get_coordinates(address):
-    apikey = os.environ['YANDEX_GEO_API']
-    coords = None
-    try:
-        coords = fetch_coordinates(apikey, address)
-    except requests.HTTPError:
-        coords = None
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
 
-    return coords
+# The cursor holds the position of the status in this list, so that any
+# status, an empty one included, is written and read back the same way
+CURSOR_STATUSES = [''] + [status for status, _ in Order.STATUS_CHOICES]
 
 
-def get_distance(addressA, addressB):
-    placeA = Place.objects.filter(address=addressA).first()
-    placeB = Place.objects.filter(address=addressB).first()
-    dist = None
+def dump_orders_cursor(order):
+    timestamp = (order.created_at - EPOCH) // datetime.timedelta(microseconds=1)
+    status_number = CURSOR_STATUSES.index(order.status)
+    return f'{status_number}_{timestamp}_{order.id}'
 
-    if placeA:
-        coordsA = placeA.lon, placeA.lat
-    else:
-        coordsA = get_coordinates(addressA)
-        save_coordinates(addressA, coordsA)
 
-    if placeB:
-        coordsB = placeB.lon, placeB.lat
-    else:
-        coordsB = get_coordinates(addressB)
-        save_coordinates(addressB, coordsB)
+def parse_orders_cursor(cursor):
+    try:
+        status_number, timestamp, order_id = map(int, cursor.split('_'))
+        if not 0 <= status_number < len(CURSOR_STATUSES):
+            return None
+        created_at = EPOCH + datetime.timedelta(microseconds=timestamp)
+        return CURSOR_STATUSES[status_number], created_at, order_id
+    except (ValueError, OverflowError):
+        return None
 
-    if coordsA and coordsB:
-        dist = round(distance.distance(coordsA, coordsB).km, 3)
 
-    return dist
+def get_day_start(date):
+    return timezone.make_aware(
+        datetime.datetime.combine(date, datetime.time.min))
+
+
+def filter_orders(orders, filters):
+    if filters.get('status'):
+        orders = orders.filter(status=filters['status'])
+    if filters.get('payment_type'):
+        orders = orders.filter(payment_type=filters['payment_type'])
+    if filters.get('restaurant'):
+        orders = orders.filter(restaurant_id=filters['restaurant'])
+    if filters.get('date_from'):
+        orders = orders.filter(
+            created_at__gte=get_day_start(filters['date_from']))
+    if filters.get('date_to'):
+        orders = orders.filter(created_at__lt=get_day_start(
+            filters['date_to'] + datetime.timedelta(days=1)))
+    return orders
+
+
+def get_order_restaurant_ids(order, order_place):
+    """Restaurants that can cook the order: the nearest ones, then the ones
+    with unknown coordinates."""
+    product_ids = [item.product_id for item in order.order_items.all()]
+    restaurant_ids = availability_index.restaurants_for(product_ids)
+    if not order_place or order_place.lat is None:
+        return list(restaurant_ids)
+
+    nearest = restaurant_locator.nearest(
+        (order_place.lat, order_place.lon),
+        product_ids,
+        k=settings.MANAGER_ORDERS_NEAREST_RESTAURANTS,
+        radius_km=settings.MANAGER_ORDERS_RESTAURANTS_RADIUS_KM,
+    )
+    not_located_ids = restaurant_ids - restaurant_locator.located(
+        restaurant_ids)
+    return [restaurant_id for restaurant_id, _ in nearest] \
+        + list(not_located_ids)
 
 
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_orders(request):
-    products = Product.objects.available().prefetch_related('menu_items')
-    orders = Order.objects.exclude(
-        status='end').price().prefetch_related('order_items').order_by('-status')
-    restaurants = Restaurant.objects.all()
+    restaurants = Restaurant.objects.in_bulk()
+    filters_form = OrdersFilter(
+        request.GET,
+        restaurants=sorted(restaurants.values(),
+                           key=lambda restaurant: restaurant.name),
+    )
+    # Invalid fields are left out of cleaned_data and do not filter
+    filters_form.is_valid()
+
+    orders = filter_orders(Order.objects.exclude(status='end'),
+                           filters_form.cleaned_data)
+    cursor = parse_orders_cursor(request.GET.get('cursor', ''))
+    orders = orders.queue_after(*cursor) if cursor else orders.queue()
+
+    page_size = settings.MANAGER_ORDERS_PAGE_SIZE
+    orders = list(
+        orders
+        .price()
+        .select_related('restaurant')
+        .prefetch_related('order_items')[:page_size + 1]
+    )
+    next_page_url = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        next_page_query = request.GET.copy()
+        next_page_query['cursor'] = dump_orders_cursor(orders[-1])
+        next_page_url = f'?{next_page_query.urlencode()}'
+    first_page_query = request.GET.copy()
+    first_page_query.pop('cursor', None)
+
+    proc_orders = [order for order in orders if order.status == 'proc']
+    proc_order_ids = {order.id for order in proc_orders}
+
+    addresses = {order.address for order in proc_orders} \
+        | {restaurant.address for restaurant in restaurants.values()}
+    # The geocoder is never waited for here: addresses it has not answered
+    # for yet are geocoded in the background and shown as pending
+    places = get_cached_places(addresses)
+    schedule_geocoding(addresses - places.keys())
+
+    with restaurant_locator.pinned():
+        restaurant_ids_by_order = {
+            order.id: [
+                restaurant_id
+                for restaurant_id in get_order_restaurant_ids(
+                    order, places.get(order.address))
+                if restaurant_id in restaurants
+            ]
+            for order in proc_orders
+        }
+    distances = get_distances(
+        (places[order.address], places[restaurants[restaurant_id].address])
+        for order in proc_orders
+        if order.address in places
+        for restaurant_id in restaurant_ids_by_order[order.id]
+        if restaurants[restaurant_id].address in places
+    )
 
     orders_with_restaurant_availability = []
 
     for order in orders:
-        if order.status != 'proc' and order.status:
+        if order.id not in proc_order_ids:
             orders_with_restaurant_availability.append({
                 'order': order,
-                'restaurants': order.restaurant.name,
+                'restaurants': order.restaurant.name
+                if order.restaurant else None,
                 'proc': False
             })
             continue
 
-        order_products_raw = [
-            item.product.id for item in order.order_items.all()]
-        order_products = list(products.filter(
-            pk__in=order_products_raw).all())
-
-        products_with_restaurants = []
-        for product in order_products:
-            restaurant_ids = [
-                item.restaurant_id for item in product.menu_items.all()]
-
-            products_with_restaurants.append({
-                'product': product,
-                'restaurant_ids': restaurant_ids
-            })
-
-        if products_with_restaurants:
-            common_restaurant_ids = products_with_restaurants[0]['restaurant_ids']
-            for i in range(1, len(products_with_restaurants)):
-                common_restaurant_ids = [id for id in common_restaurant_ids[i]
-                                         ['restaurant_ids'] if id in common_restaurant_ids[i-1]['restaurant_ids']]
-
-            restaurants_with_km = {}
-            restaurants_no_km = []
-            for id in common_restaurant_ids:
-                restaurant = restaurants.filter(id=id).get()
-                dist = get_distance(order.address, restaurant.address)
-                
-                if dist:
-                    restaurants_with_km[dist] = restaurant.name
-                else:
-                    restaurants_no_km.append(restaurant.name)
-
-            km_sorted = sorted(restaurants_with_km)
-            restaurants_with_km_sorted = [
-                restaurants_with_km[key] + " - " + str(key) + " км" for key in km_sorted]
-            restaurants_no_km_sorted = [
-                name + " - ? км" for name in restaurants_no_km]
-
-            orders_with_restaurant_availability.append({
-                'order': order,
-                'restaurants': restaurants_with_km_sorted + restaurants_no_km_sorted,
-                'proc': True
-            })
+        order_place = places.get(order.address)
+        restaurants_with_km = []
+        restaurants_no_km = []
+        for restaurant_id in restaurant_ids_by_order[order.id]:
+            restaurant = restaurants[restaurant_id]
+            restaurant_place = places.get(restaurant.address)
+            dist = None
+            if order_place and restaurant_place:
+                dist = distances.get((order_place.id, restaurant_place.id))
+
+            if dist is not None:
+                restaurants_with_km.append((round(dist, 3), restaurant.name))
+            else:
+                restaurants_no_km.append(restaurant.name)
+
+        restaurants_with_km_sorted = [
+            f'{name} - {dist} км' for dist, name in sorted(restaurants_with_km)]
+        restaurants_no_km_sorted = [
+            f'{name} - ? км' for name in sorted(restaurants_no_km)]
+
+        orders_with_restaurant_availability.append({
+            'order': order,
+            'restaurants': restaurants_with_km_sorted + restaurants_no_km_sorted,
+            'proc': True,
+            'geocoding': order_place is None,
+        })
 
     return render(request, template_name='order_items.html', context={
-        'order_items': orders_with_restaurant_availability
+        'order_items': orders_with_restaurant_availability,
+        'filters_form': filters_form,
+        'first_page_url': f'?{first_page_query.urlencode()}',
+        'next_page_url': next_page_url,
+        'is_first_page': cursor is None,
     })
+
+
+@require_POST
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def dispatch_orders(request):
+    plan = plan_dispatch()
+    assigned_count = apply_dispatch(plan)
+    messages.success(
+        request,
+        f'Ресторан назначен заказам: {assigned_count}, '
+        f'суммарное расстояние {sum(plan["kms"].values()):.1f} км. '
+        f'Осталось распределить вручную: {len(plan["unassigned_ids"])}.'
+    )
+    return redirect('restaurateur:view_orders')
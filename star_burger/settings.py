@@ -87,6 +87,23 @@ DATABASES = {
         default='sqlite:////{0}'.format(os.path.join(BASE_DIR, 'db.sqlite3'))
     )
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Transactions take the write lock when they begin, so concurrent
+    # writers wait for each other instead of failing with "database is
+    # locked" when a read lock can not be upgraded
+    DATABASES['default'].setdefault('OPTIONS', {}).setdefault(
+        'transaction_mode', 'IMMEDIATE')
+    # The test database is a file rather than shared memory, where
+    # concurrent connections fail at once instead of waiting for the lock
+    DATABASES['default'].setdefault('TEST', {}).setdefault(
+        'NAME', os.path.join(BASE_DIR, 'test_db.sqlite3'))
+
+# Cache versions must be seen by every process of the site, management
+# commands included, so the default cache is on disk rather than in memory
+CACHES = {
+    'default': env.dj_cache_url(
+        'CACHE_URL', 'file://{0}'.format(os.path.join(BASE_DIR, 'cache'))),
+}
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -124,3 +141,37 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "assets"),
     os.path.join(BASE_DIR, "bundles"),
 ]
+
+ORDERS_BATCH_MAX_SIZE = env.int('ORDERS_BATCH_MAX_SIZE', 500)
+
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+ORDER_SPOOL_PATH = env('ORDER_SPOOL_PATH', os.path.join(BASE_DIR, 'order_spool.sqlite3'))
+
+API_JSON_COMPACT = env.bool('API_JSON_COMPACT', not DEBUG)
+API_PRECOMPRESS = env.bool('API_PRECOMPRESS', True)
+
+PRODUCTS_PAGE_SIZE = env.int('PRODUCTS_PAGE_SIZE', 100)
+PRODUCTS_PAGE_MAX_SIZE = env.int('PRODUCTS_PAGE_MAX_SIZE', 1000)
+
+PRODUCT_IMAGE_WIDTHS = env.list('PRODUCT_IMAGE_WIDTHS', [160, 320, 640],
+                                subcast=int)
+
+MANAGER_ORDERS_PAGE_SIZE = env.int('MANAGER_ORDERS_PAGE_SIZE', 50)
+MANAGER_PRODUCTS_PAGE_SIZE = env.int('MANAGER_PRODUCTS_PAGE_SIZE', 100)
+MANAGER_ORDERS_NEAREST_RESTAURANTS = env.int(
+    'MANAGER_ORDERS_NEAREST_RESTAURANTS', 10)
+MANAGER_ORDERS_RESTAURANTS_RADIUS_KM = env.float(
+    'MANAGER_ORDERS_RESTAURANTS_RADIUS_KM', None)
+
+DISPATCH_CANDIDATES = env.int('DISPATCH_CANDIDATES', 10)
+DISPATCH_TIME_BUDGET = env.float('DISPATCH_TIME_BUDGET', 1)
+
+GEOCODER_URL = env.str('GEOCODER_URL', 'https://geocode-maps.yandex.ru/1.x')
+GEOCODER_CONNECT_TIMEOUT = env.float('GEOCODER_CONNECT_TIMEOUT', 3.05)
+GEOCODER_READ_TIMEOUT = env.float('GEOCODER_READ_TIMEOUT', 5)
+GEOCODER_MAX_RETRIES = env.int('GEOCODER_MAX_RETRIES', 3)
+GEOCODER_BACKOFF = env.float('GEOCODER_BACKOFF', 0.5)
+GEOCODER_MAX_BACKOFF = env.float('GEOCODER_MAX_BACKOFF', 10)
+GEOCODER_BREAKER_THRESHOLD = env.int('GEOCODER_BREAKER_THRESHOLD', 5)
+GEOCODER_BREAKER_COOLDOWN = env.float('GEOCODER_BREAKER_COOLDOWN', 30)